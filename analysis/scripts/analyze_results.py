@@ -8,36 +8,157 @@ Usage:
 from __future__ import annotations
 
 import json
+import mmap
 import os
+import re
 import sys
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import accumulate
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, Optional
+
+try:
+    # C-accelerated parser; k6 NDJSON files routinely reach millions of lines.
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PERCENTILES = (0.50, 0.95, 0.99)
+# Durations are binned per whole millisecond up to this bound; the summary
+# table only reports ms resolution.  Slower samples are kept verbatim.
+DURATION_HIST_MAX_MS = 30000
+# Part of the parsed-metrics sidecar key: bump whenever _parse_k6_json's output
+# changes, so sidecars written by an older parser are re-parsed.
+PARSER_VERSION = 1
+
+
+@dataclass
+class _K6Totals:
+    """Running accumulators for the k6 metrics the summary reports."""
+
+    duration_hist: list[int] = field(
+        default_factory=lambda: [0] * (DURATION_HIST_MAX_MS + 1)
+    )
+    duration_overflow: array = field(default_factory=lambda: array("d"))
+    failures: int = 0
+    total: int = 0
+    retries: float = 0
+
+    def add_duration(self, v: float) -> None:
+        ms = round(v)
+        if ms <= DURATION_HIST_MAX_MS:
+            self.duration_hist[ms] += 1
+        else:
+            self.duration_overflow.append(v)
+
+    def add_failed(self, v: float) -> None:
+        self.total += 1
+        if v == 1:
+            self.failures += 1
+
+    def add_retries(self, v: float) -> None:
+        self.retries += v
+
+
+# k6 emits ~a dozen Point lines per request, but only these metrics feed the
+# summary.  The metric name is sliced out of the raw line and looked up here
+# so every other line is skipped without being JSON-decoded at all.
+_METRIC_KEY = b'"metric":"'
+_METRIC_HANDLERS: dict[str, Callable[[_K6Totals, float], None]] = {
+    "http_req_duration": _K6Totals.add_duration,
+    "http_req_failed": _K6Totals.add_failed,
+    "client_retries_total": _K6Totals.add_retries,
+}
+_METRIC_NAMES = frozenset(name.encode() for name in _METRIC_HANDLERS)
+
+# k6 end-of-test summary: only lines for these two metrics feed the table, and
+# the regex engine skips every other line without a Python-level loop.
+_K6_TEXT_METRIC_RE = re.compile(r"^.*?(http_req_duration|http_req_failed).*$", re.MULTILINE)
+_K6_PERCENTILE_RE = re.compile(r"(?<!\S)p\((50|95|99)\)=(\S+)")
+_K6_RATE_RE = re.compile(r"(?<!\S)(\S*)%")
 
 
 def parse_k6_summary(results_dir: Path) -> dict:
-    """Parse k6 summary from all config subdirectories."""
+    """Parse k6 summary from all config subdirectories.
+
+    Config directories are independent and parsing is CPU-bound, so they are
+    fanned out across a process pool (one worker per core).
+    """
+    config_dirs = [d for d in sorted(results_dir.iterdir()) if d.is_dir()]
+    if len(config_dirs) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(config_dirs), os.cpu_count() or 1)) as pool:
+            parsed = list(pool.map(_parse_config_dir, config_dirs))
+    else:
+        parsed = [_parse_config_dir(d) for d in config_dirs]
+
     configs = {}
-    for config_dir in sorted(results_dir.iterdir()):
-        if not config_dir.is_dir():
-            continue
-        config = config_dir.name
-        results_file = config_dir / "k6_results.json"
-        output_file = config_dir / "k6_output.txt"
+    for config_dir, metrics in zip(config_dirs, parsed):
+        if metrics:
+            configs[config_dir.name] = metrics
+    return configs
 
-        metrics = {}
 
-        # Parse structured JSON output
-        if results_file.exists():
-            metrics = _parse_k6_json(results_file)
+def _parse_config_dir(config_dir: Path) -> dict:
+    """Parse one config's k6 output, preferring the structured JSON file."""
+    results_file = config_dir / "k6_results.json"
+    output_file = config_dir / "k6_output.txt"
 
-        # Parse text output as fallback
-        if not metrics and output_file.exists():
-            metrics = _parse_k6_text(output_file)
+    metrics = {}
 
-        if metrics:
-            configs[config] = metrics
+    # Parse structured JSON output
+    if results_file.exists():
+        metrics = _cached_parse_k6_json(results_file)
 
-    return configs
+    # Parse text output as fallback
+    if not metrics and output_file.exists():
+        metrics = _parse_k6_text(output_file)
+
+    return metrics
+
+
+def _cached_parse_k6_json(path: Path) -> dict:
+    """Memoize _parse_k6_json in a sidecar file keyed by the input's mtime + size
+    and PARSER_VERSION.
+
+    Re-running the analysis over an unchanged scenario then skips the parse.
+    A parse that found no samples is not cached, so a file still being written
+    (or one that failed to parse) is read again next time.
+    """
+    cache_path = path.with_suffix(".parsed.json")
+    st = path.stat()
+    try:
+        cached = json.loads(cache_path.read_bytes())
+        if (
+            cached["parser_version"] == PARSER_VERSION
+            and cached["mtime_ns"] == st.st_mtime_ns
+            and cached["size"] == st.st_size
+        ):
+            return cached["metrics"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    metrics = _parse_k6_json(path)
+    if not metrics["iterations"] and metrics["http_req_failed_rate"] is None:
+        return metrics
+    try:
+        cache_path.write_text(json.dumps({
+            "parser_version": PARSER_VERSION,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "metrics": metrics,
+        }))
+    except OSError as exc:
+        print(f"  Warning: could not write cache {cache_path}: {exc}", file=sys.stderr)
+    return metrics
 
 
 def _parse_k6_json(path: Path) -> dict:
@@ -52,46 +173,25 @@ def _parse_k6_json(path: Path) -> dict:
         "iterations": 0,
     }
     try:
-        durations = []
-        failures = 0
-        total = 0
-        retries = 0
-
-        with open(path) as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-
-                if obj.get("type") == "Point":
-                    m = obj.get("metric", "")
-                    v = obj.get("data", {}).get("value", 0)
-                    if m == "http_req_duration":
-                        durations.append(v)
-                    elif m == "http_req_failed":
-                        total += 1
-                        if v == 1:
-                            failures += 1
-                    elif m == "client_retries_total":
-                        retries += v
-
-        if durations:
-            durations_sorted = sorted(durations)
-            n = len(durations_sorted)
-            metrics["http_req_duration_p50"] = durations_sorted[int(n * 0.50)]
-            metrics["http_req_duration_p95"] = durations_sorted[int(n * 0.95)]
-            metrics["http_req_duration_p99"] = durations_sorted[int(n * 0.99)]
+        totals = _K6Totals()
+        for handler, v in _iter_k6_points(path):
+            handler(totals, v)
+
+        n = sum(totals.duration_hist) + len(totals.duration_overflow)
+        if n:
+            p50, p95, p99 = _duration_percentiles(
+                totals.duration_hist, totals.duration_overflow, PERCENTILES
+            )
+            metrics["http_req_duration_p50"] = p50
+            metrics["http_req_duration_p95"] = p95
+            metrics["http_req_duration_p99"] = p99
             metrics["iterations"] = n
 
-        if total > 0:
-            metrics["http_req_failed_rate"] = failures / total
-            metrics["order_success_rate"] = 1 - (failures / total)
+        if totals.total > 0:
+            metrics["http_req_failed_rate"] = totals.failures / totals.total
+            metrics["order_success_rate"] = 1 - (totals.failures / totals.total)
 
-        metrics["client_retries_total"] = int(retries)
+        metrics["client_retries_total"] = int(totals.retries)
 
     except Exception as exc:
         print(f"  Warning: could not parse {path}: {exc}", file=sys.stderr)
@@ -99,36 +199,101 @@ def _parse_k6_json(path: Path) -> dict:
     return metrics
 
 
+def _iter_k6_points(path: Path) -> Iterator[tuple[Callable[[_K6Totals, float], None], float]]:
+    """Yield ``(handler, value)`` for every summary-relevant k6 Point in *path*.
+
+    The file is memory-mapped and walked with ``find()``: skipped lines are
+    never copied out of the page cache, and kept ones reach the parser as raw
+    bytes with no UTF-8 decode into str.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap refuses empty files
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            pos = 0
+            while pos < size:
+                end = mm.find(b"\n", pos)
+                if end == -1:
+                    end = size
+                start, pos = pos, end + 1
+                key = mm.find(_METRIC_KEY, start, end)
+                if key != -1:
+                    key += len(_METRIC_KEY)
+                    if mm[key:mm.find(b'"', key, end)] not in _METRIC_NAMES:
+                        continue
+                    line = mm[start:end]
+                else:
+                    line = mm[start:end].strip()
+                    if not line:
+                        continue
+                try:
+                    obj = _json_loads(line)
+                except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
+                    continue
+
+                if obj.get("type") == "Point":
+                    handler = _METRIC_HANDLERS.get(obj.get("metric"))
+                    if handler is not None:
+                        yield handler, obj.get("data", {}).get("value", 0)
+
+
+def _duration_percentiles(
+    hist: list[int], overflow: array, fractions: tuple[float, ...]
+) -> list[float]:
+    """Nearest-rank percentiles from the per-ms histogram plus overflow samples.
+
+    Every overflow sample is slower than every binned one, so ranks past the
+    histogram's total index into the (small) sorted overflow tail.
+    """
+    cum = list(accumulate(hist))
+    binned = cum[-1]
+    ranks = [int((binned + len(overflow)) * f) for f in fractions]
+    tail = iter(_select_ranks(overflow, [r - binned for r in ranks if r >= binned]))
+    return [float(bisect_right(cum, r)) if r < binned else next(tail) for r in ranks]
+
+
+def _select_ranks(values: array, ranks: list[int]) -> list[float]:
+    """Return the order statistics ``sorted(values)[r]`` for each rank.
+
+    Only a handful of ranks are needed, so numpy's O(n) introselect
+    (``np.partition``) replaces a full sort when numpy is available.
+    """
+    if not ranks:
+        return []
+    if np is not None:
+        part = np.partition(np.frombuffer(values, dtype=np.float64), ranks)
+        return [float(part[r]) for r in ranks]
+    ordered = sorted(values)
+    return [ordered[r] for r in ranks]
+
+
 def _parse_k6_text(path: Path) -> dict:
     """Parse k6 text output (fallback)."""
     metrics: dict = {}
     try:
         text = path.read_text()
-        for line in text.splitlines():
-            if "http_req_duration" in line and "avg=" in line:
-                # Extract p50, p95, p99
-                parts = line.split()
-                for part in parts:
-                    if part.startswith("p(50)="):
-                        metrics["http_req_duration_p50"] = _parse_duration(part.split("=")[1])
-                    elif part.startswith("p(95)="):
-                        metrics["http_req_duration_p95"] = _parse_duration(part.split("=")[1])
-                    elif part.startswith("p(99)="):
-                        metrics["http_req_duration_p99"] = _parse_duration(part.split("=")[1])
-            elif "http_req_failed" in line:
-                for part in line.split():
-                    if "%" in part:
-                        try:
-                            rate = float(part.replace("%", "")) / 100
-                            metrics["http_req_failed_rate"] = rate
-                            metrics["order_success_rate"] = 1 - rate
-                        except ValueError:
-                            pass
+        for match in _K6_TEXT_METRIC_RE.finditer(text):
+            line = match.group(0)
+            if match.group(1) == "http_req_duration":
+                if "avg=" in line:
+                    # Extract p50, p95, p99
+                    for pct, value in _K6_PERCENTILE_RE.findall(line):
+                        metrics[f"http_req_duration_p{pct}"] = _parse_duration(value)
+            else:
+                for value in _K6_RATE_RE.findall(line):
+                    try:
+                        rate = float(value) / 100
+                        metrics["http_req_failed_rate"] = rate
+                        metrics["order_success_rate"] = 1 - rate
+                    except ValueError:
+                        pass
     except Exception:
         pass
     return metrics
 
 
+@lru_cache(maxsize=4096)  # k6 summaries repeat a small set of duration strings
 def _parse_duration(s: str) -> Optional[float]:
     """Parse k6 duration string like '123.4ms' or '1.2s' to milliseconds."""
     s = s.strip()
@@ -146,9 +311,13 @@ def _parse_duration(s: str) -> Optional[float]:
 
 def print_table(configs: dict) -> None:
     """Print a Markdown comparison table."""
+    sys.stdout.write(format_table(configs))
+
+
+def format_table(configs: dict) -> str:
+    """Render the Markdown comparison table as a single string."""
     if not configs:
-        print("No results found.")
-        return
+        return "No results found.\n"
 
     headers = ["Config", "Success Rate", "P50 (ms)", "P95 (ms)", "P99 (ms)", "Error Rate", "Retries"]
     col_widths = [8, 13, 9, 9, 9, 11, 9]
@@ -158,22 +327,24 @@ def print_table(configs: dict) -> None:
 
     separator = "|-" + "-|-".join("-" * w for w in col_widths) + "-|"
 
-    print()
-    print("## Results Summary")
-    print()
-    print(row(headers))
-    print(separator)
-
+    lines = ["", "## Results Summary", "", row(headers), separator]
     for config, m in sorted(configs.items()):
-        sr = f"{m.get('order_success_rate', 0) * 100:.1f}%" if m.get('order_success_rate') else "N/A"
-        p50 = f"{m.get('http_req_duration_p50', 0):.0f}" if m.get('http_req_duration_p50') else "N/A"
-        p95 = f"{m.get('http_req_duration_p95', 0):.0f}" if m.get('http_req_duration_p95') else "N/A"
-        p99 = f"{m.get('http_req_duration_p99', 0):.0f}" if m.get('http_req_duration_p99') else "N/A"
-        er = f"{m.get('http_req_failed_rate', 0) * 100:.1f}%" if m.get('http_req_failed_rate') is not None else "N/A"
-        retries = str(m.get("client_retries_total", "N/A"))
-        print(row([config, sr, p50, p95, p99, er, retries]))
-
-    print()
+        success = m.get("order_success_rate")
+        p50 = m.get("http_req_duration_p50")
+        p95 = m.get("http_req_duration_p95")
+        p99 = m.get("http_req_duration_p99")
+        error = m.get("http_req_failed_rate")
+        lines.append(row([
+            config,
+            f"{success * 100:.1f}%" if success else "N/A",
+            f"{p50:.0f}" if p50 else "N/A",
+            f"{p95:.0f}" if p95 else "N/A",
+            f"{p99:.0f}" if p99 else "N/A",
+            f"{error * 100:.1f}%" if error is not None else "N/A",
+            str(m.get("client_retries_total", "N/A")),
+        ]))
+    lines.append("")
+    return "\n".join(lines) + "\n"
 
 
 def main():
@@ -192,13 +363,7 @@ def main():
 
     # Save markdown summary
     summary_path = results_dir / "summary.md"
-    import io
-    old_stdout = sys.stdout
-    sys.stdout = buffer = io.StringIO()
-    print(f"# Results: {results_dir.name}")
-    print_table(configs)
-    sys.stdout = old_stdout
-    summary_path.write_text(buffer.getvalue())
+    summary_path.write_text(f"# Results: {results_dir.name}\n" + format_table(configs))
     print(f"Summary saved to {summary_path}")
 
 
@@ -10,9 +10,16 @@ from __future__ import annotations
 import argparse
 import json
 import time
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 PROMETHEUS_URL = "http://localhost:9090"
 
@@ -41,7 +48,11 @@ def query_prometheus(query: str) -> list[dict]:
         return [{"error": str(exc)}]
 
 
-import urllib.parse
+def _dumps_indented(obj) -> bytes:
+    """Serialize *obj* as 2-space-indented JSON, via orjson's C encoder if installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
 
 
 def main():
@@ -59,14 +70,17 @@ def main():
         "metrics": {},
     }
 
-    for name, query in QUERIES.items():
-        results = query_prometheus(query)
-        snapshot["metrics"][name] = results
-        print(f"  {name}: {len(results)} series")
+    # Queries are independent, so issue them concurrently: total wall time is
+    # one round trip rather than one per query.
+    with ThreadPoolExecutor(max_workers=len(QUERIES)) as pool:
+        all_results = pool.map(query_prometheus, QUERIES.values())
+        for name, results in zip(QUERIES, all_results):
+            snapshot["metrics"][name] = results
+            print(f"  {name}: {len(results)} series")
 
     out = Path(args.output)
     out.parent.mkdir(parents=True, exist_ok=True)
-    out.write_text(json.dumps(snapshot, indent=2))
+    out.write_bytes(_dumps_indented(snapshot))
     print(f"\nSnapshot saved to {out}")
 
 
@@ -14,6 +14,7 @@ from .metrics import (
     IDEMPOTENCY_CONFLICTS,
     LOAD_SHED_TOTAL,
     metrics_app,
+    cached_metrics_app,
 )
 from .tracing import setup_tracing, get_tracer
 from .middleware import ObservabilityMiddleware
@@ -33,6 +34,7 @@ __all__ = [
     "IDEMPOTENCY_CONFLICTS",
     "LOAD_SHED_TOTAL",
     "metrics_app",
+    "cached_metrics_app",
     "setup_tracing",
     "get_tracer",
     "ObservabilityMiddleware",
@@ -12,7 +12,6 @@ Every log record includes:
 """
 from __future__ import annotations
 
-import json
 import logging
 import os
 import sys
@@ -20,52 +19,98 @@ import time
 from contextvars import ContextVar
 from typing import Optional
 
+import orjson
+
 correlation_id_var: ContextVar[str] = ContextVar("correlation_id", default="")
 SERVICE_NAME = os.getenv("SERVICE_NAME", "unknown")
 
+# Attributes every LogRecord carries; anything else came in via extra={}.
+_LOG_RECORD_ATTRS = frozenset({
+    "name", "msg", "args", "levelname", "levelno", "pathname",
+    "filename", "module", "exc_info", "exc_text", "stack_info",
+    "lineno", "funcName", "created", "msecs", "relativeCreated",
+    "thread", "threadName", "processName", "process", "message",
+    "taskName",
+})
 
-class JsonFormatter(logging.Formatter):
-    def format(self, record: logging.LogRecord) -> str:
-        # Try to get OTel trace context
-        trace_id = ""
-        span_id = ""
+# (epoch second, "YYYY-MM-DDTHH:MM:SS") of the last formatted record.  Bursts of
+# records share a wall-clock second, so strftime runs at most once per second.
+_ts_cache: tuple[int, str] = (-1, "")
+
+
+def _iso_timestamp(created: float, msecs: float) -> str:
+    global _ts_cache
+    sec = int(created)
+    cached_sec, prefix = _ts_cache
+    if sec != cached_sec:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+        _ts_cache = (sec, prefix)
+    return f"{prefix}.{int(msecs):03d}Z"
+
+
+# opentelemetry.trace.get_current_span, resolved on first use; None when
+# OpenTelemetry is not installed, in which case trace ids are left empty.
+_get_current_span = None
+_otel_probed = False
+
+
+def _current_span_ids() -> tuple[str, str]:
+    """Return (trace_id, span_id) of the active OTel span, or empty strings."""
+    global _get_current_span, _otel_probed
+    if not _otel_probed:
         try:
-            from opentelemetry import trace as otel_trace
-            span = otel_trace.get_current_span()
-            ctx = span.get_span_context()
-            if ctx.is_valid:
-                trace_id = format(ctx.trace_id, "032x")
-                span_id = format(ctx.span_id, "016x")
-        except Exception:
+            from opentelemetry.trace import get_current_span
+            _get_current_span = get_current_span
+        except ImportError:
             pass
+        _otel_probed = True
+    if _get_current_span is None:
+        return "", ""
+    try:
+        ctx = _get_current_span().get_span_context()
+        if ctx.is_valid:
+            return format(ctx.trace_id, "032x"), format(ctx.span_id, "016x")
+    except Exception:
+        pass
+    return "", ""
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._get_correlation_id = correlation_id_var.get
+
+    def format(self, record: logging.LogRecord) -> str:
+        attrs = record.__dict__
+        trace_id, span_id = _current_span_ids()
 
         log_entry = {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
-                         + f".{int(record.msecs):03d}Z",
+            "timestamp": _iso_timestamp(record.created, record.msecs),
             "level": record.levelname,
             "logger": record.name,
             "service": SERVICE_NAME,
-            "correlation_id": correlation_id_var.get(""),
+            # Callers that already hold the id (e.g. the access-log middleware)
+            # pass it via extra={}, which saves the context lookup.
+            "correlation_id": attrs["correlation_id"] if "correlation_id" in attrs
+                              else self._get_correlation_id(""),
             "trace_id": trace_id,
             "span_id": span_id,
             "message": record.getMessage(),
         }
 
         # Merge any extra fields added via extra={} in log calls
-        for key, value in record.__dict__.items():
-            if key not in {
-                "name", "msg", "args", "levelname", "levelno", "pathname",
-                "filename", "module", "exc_info", "exc_text", "stack_info",
-                "lineno", "funcName", "created", "msecs", "relativeCreated",
-                "thread", "threadName", "processName", "process", "message",
-                "taskName",
-            }:
-                log_entry[key] = value
+        for key in attrs.keys() - _LOG_RECORD_ATTRS:
+            log_entry[key] = attrs[key]
 
         if record.exc_info:
-            log_entry["exception"] = self.formatException(record.exc_info)
+            # Cache on the record (as logging.Formatter does) so the traceback
+            # is walked once even when several handlers format the record.
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            log_entry["exception"] = record.exc_text
 
-        return json.dumps(log_entry)
+        # orjson's C encoder; default=str keeps arbitrary extra={} values loggable
+        return orjson.dumps(log_entry, default=str).decode()
 
 
 def setup_logging(level: str = "INFO") -> None:
@@ -3,7 +3,17 @@
 All metrics are created here so import order doesn't matter.  Each service
 imports the metrics it needs; unused ones stay at zero.
 """
-from prometheus_client import Counter, Gauge, Histogram, make_asgi_app
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    make_asgi_app,
+)
 
 # ── HTTP layer ──────────────────────────────────────────────────────────────
 HTTP_REQUESTS_TOTAL = Counter(
@@ -103,3 +113,30 @@ DUPLICATE_WRITE_RATE = Counter(
 
 # ASGI app that Prometheus can scrape
 metrics_app = make_asgi_app()
+
+
+def cached_metrics_app(ttl: float = 1.0):
+    """ASGI app serving the text exposition, rendered at most once per *ttl* s.
+
+    Walking and formatting every metric is the expensive part of a scrape;
+    scrapes arriving within *ttl* of each other share one rendering.
+    """
+    cached_at, body = float("-inf"), b""
+
+    async def app(scope, receive, send) -> None:
+        nonlocal cached_at, body
+        now = time.monotonic()
+        if now - cached_at >= ttl:
+            body = generate_latest(REGISTRY)
+            cached_at = now
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", CONTENT_TYPE_LATEST.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    return app
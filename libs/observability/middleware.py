@@ -21,12 +21,15 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
     def __init__(self, app: Any, service_name: str) -> None:
         super().__init__(app)
         self._service = service_name
+        # Bound metric children, so the hot path skips labels() resolution
+        self._request_counters: dict[tuple[str, str, int], Any] = {}
+        self._duration_histograms: dict[tuple[str, str], Any] = {}
 
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
         correlation_id = request.headers.get("X-Correlation-ID", str(uuid.uuid4()))
         token = correlation_id_var.set(correlation_id)
 
-        start = time.perf_counter()
+        start_ns = time.perf_counter_ns()
         status_code = 500
         try:
             response = await call_next(request)
@@ -35,22 +38,33 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
         except Exception:
             raise
         finally:
-            elapsed = time.perf_counter() - start
+            elapsed_ns = time.perf_counter_ns() - start_ns
             route = request.url.path
 
             # Don't track metrics path itself to avoid cardinality explosion
             if route != "/metrics":
-                HTTP_REQUESTS_TOTAL.labels(
-                    service=self._service,
-                    route=route,
-                    method=request.method,
-                    status=str(status_code),
-                ).inc()
-                REQUEST_DURATION.labels(
-                    service=self._service,
-                    route=route,
-                    method=request.method,
-                ).observe(elapsed)
+                method = request.method
+                counter = self._request_counters.get((route, method, status_code))
+                if counter is None:
+                    counter = self._request_counters[(route, method, status_code)] = (
+                        HTTP_REQUESTS_TOTAL.labels(
+                            service=self._service,
+                            route=route,
+                            method=method,
+                            status=str(status_code),
+                        )
+                    )
+                counter.inc()
+                histogram = self._duration_histograms.get((route, method))
+                if histogram is None:
+                    histogram = self._duration_histograms[(route, method)] = (
+                        REQUEST_DURATION.labels(
+                            service=self._service,
+                            route=route,
+                            method=method,
+                        )
+                    )
+                histogram.observe(elapsed_ns / 1e9)
 
             logger.info(
                 "request",
@@ -58,7 +72,7 @@ class ObservabilityMiddleware(BaseHTTPMiddleware):
                     "method": request.method,
                     "path": route,
                     "status": status_code,
-                    "duration_ms": round(elapsed * 1000, 2),
+                    "duration_ms": elapsed_ns // 10_000 / 100,
                     "correlation_id": correlation_id,
                 },
             )
@@ -1,6 +1,6 @@
 """Resilience middleware library: retries, circuit breakers, bulkheads, idempotency."""
 
-from .retry import retry_with_backoff, RetryConfig
+from .retry import retry_with_backoff, retry_http_with_backoff, RetryConfig
 from .circuit_breaker import CircuitBreaker, CircuitState
 from .bulkhead import Bulkhead
 from .idempotency import IdempotencyMiddleware, IdempotencyStore
@@ -9,6 +9,7 @@ from .backpressure import BackpressureMiddleware
 
 __all__ = [
     "retry_with_backoff",
+    "retry_http_with_backoff",
     "RetryConfig",
     "CircuitBreaker",
     "CircuitState",
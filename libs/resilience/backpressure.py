@@ -8,14 +8,13 @@ Returns HTTP 429 (Too Many Requests) with Retry-After header.
 """
 from __future__ import annotations
 
-import asyncio
 import logging
 import time
 from typing import Any, Optional
 
 from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.responses import JSONResponse
 
 from libs.observability.metrics import LOAD_SHED_TOTAL
 
@@ -25,6 +24,11 @@ logger = logging.getLogger(__name__)
 class BackpressureMiddleware(BaseHTTPMiddleware):
     """Shed load when the service is above configured concurrency limit.
 
+    The inflight counter is a plain int with no lock: the check-and-increment
+    and the decrement contain no ``await``, so they cannot interleave with
+    other requests on the same event loop.  Each worker process keeps its
+    own counter.
+
     Args:
         max_inflight: maximum concurrent requests before shedding
         skip_paths: paths exempt from load shedding (health, metrics)
@@ -39,33 +43,33 @@ class BackpressureMiddleware(BaseHTTPMiddleware):
         super().__init__(app)
         self._max_inflight = max_inflight
         self._inflight = 0
-        self._skip_paths = set(skip_paths or ["/health", "/metrics", "/ready"])
-        self._lock = asyncio.Lock()
+        # A short tuple compares faster than hashing the path into a set
+        self._skip_paths = tuple(skip_paths or ["/health", "/metrics", "/ready"])
 
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        if request.url.path in self._skip_paths:
+        # Raw scope path: request.url would build and parse a URL object
+        path = request.scope["path"]
+        if path in self._skip_paths:
             return await call_next(request)
 
-        async with self._lock:
-            if self._inflight >= self._max_inflight:
-                LOAD_SHED_TOTAL.labels(service="gateway").inc()
-                logger.warning(
-                    "load_shed",
-                    extra={
-                        "inflight": self._inflight,
-                        "max": self._max_inflight,
-                        "path": request.url.path,
-                    },
-                )
-                return JSONResponse(
-                    {"detail": "Too many requests – server overloaded"},
-                    status_code=429,
-                    headers={"Retry-After": "5"},
-                )
-            self._inflight += 1
+        if self._inflight >= self._max_inflight:
+            LOAD_SHED_TOTAL.labels(service="gateway").inc()
+            logger.warning(
+                "load_shed",
+                extra={
+                    "inflight": self._inflight,
+                    "max": self._max_inflight,
+                    "path": path,
+                },
+            )
+            return ORJSONResponse(
+                {"detail": "Too many requests – server overloaded"},
+                status_code=429,
+                headers={"Retry-After": "5"},
+            )
+        self._inflight += 1
 
         try:
             return await call_next(request)
         finally:
-            async with self._lock:
-                self._inflight -= 1
+            self._inflight -= 1
@@ -38,9 +38,13 @@ class Bulkhead:
     async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
         """Execute *func* within the bulkhead, rejecting if at capacity."""
         try:
-            acquired = await asyncio.wait_for(
-                self._semaphore.acquire(), timeout=self.max_wait
-            )
+            if self._semaphore.locked():
+                async with asyncio.timeout(self.max_wait):
+                    await self._semaphore.acquire()
+            else:
+                # Fast path: a slot is free, so acquire() returns without
+                # suspending and no timeout machinery is needed.
+                await self._semaphore.acquire()
         except asyncio.TimeoutError:
             BULKHEAD_REJECTIONS.labels(downstream=self.name).inc()
             logger.warning(
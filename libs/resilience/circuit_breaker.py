@@ -3,24 +3,91 @@
 States:
 - CLOSED  – normal operation; failure counter accumulates
 - OPEN    – all calls rejected immediately (fast fail)
-- HALF_OPEN – one probe call allowed; success→CLOSED, failure→OPEN
+- HALF_OPEN – one probe call at a time; success→CLOSED, failure→OPEN
 
 The state is stored in Redis so all replicas of a service share a single
 breaker per downstream, preventing one pod from probing while others still
-fast-fail.  Falls back to in-process state if Redis is unavailable.
+fast-fail.  Falls back to in-process state if Redis is unavailable, and stays
+there for REDIS_ERROR_COOLDOWN after each error.  The client's pool should set
+short socket timeouts so a hung Redis fails fast instead of stalling calls.
+Pass the service's process-wide Redis client (one connection pool shared with
+the idempotency store) rather than a dedicated client per breaker.
 """
 from __future__ import annotations
 
-import asyncio
 import logging
 import time
+import uuid
 from enum import Enum
 from typing import Any, Callable, Awaitable, Optional
 
+from fastapi import HTTPException
+
 from libs.observability.metrics import BREAKER_STATE, BREAKER_OPEN_TOTAL
 
 logger = logging.getLogger(__name__)
 
+# Failures are counted in this many equal slices of the rolling window
+WINDOW_BUCKETS = 10
+
+# After a Redis error the breaker runs on in-process state for this long
+# before trying the shared state again, so an unreachable Redis costs one
+# failed call (and one log line) per cooldown rather than one per request.
+REDIS_ERROR_COOLDOWN = 5.0  # seconds
+
+# Shared (Redis) breaker state machine, run atomically server-side so each
+# breaker step is one round trip and replicas cannot race each other.
+#   KEYS[1] state hash {state, opened_at, successes}   KEYS[2] failure zset
+#   ARGV    op (check|success|failure), failure_threshold, success_threshold,
+#           window_size, open_duration, failure member id
+# Returns {state, event}; event is "", "half_open", "tripped" or "closed".
+_BREAKER_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local op = ARGV[1]
+local window = tonumber(ARGV[4])
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local event = ''
+
+local function trip()
+  state = 'open'
+  event = 'tripped'
+  redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now, 'successes', 0)
+  redis.call('DEL', KEYS[2])
+end
+
+if state == 'open' then
+  local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at') or '0')
+  if now - opened_at >= tonumber(ARGV[5]) then
+    state = 'half_open'
+    event = 'half_open'
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'successes', 0)
+  end
+end
+
+if op == 'failure' then
+  if state == 'half_open' then
+    trip()
+  elseif state == 'closed' then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - window)
+    redis.call('ZADD', KEYS[2], now, ARGV[6])
+    redis.call('PEXPIRE', KEYS[2], math.ceil(window * 1000))
+    if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[2]) then
+      trip()
+    end
+  end
+elseif op == 'success' and state == 'half_open' then
+  if redis.call('HINCRBY', KEYS[1], 'successes', 1) >= tonumber(ARGV[3]) then
+    state = 'closed'
+    event = 'closed'
+    redis.call('HSET', KEYS[1], 'state', 'closed', 'successes', 0)
+    redis.call('DEL', KEYS[2])
+  end
+end
+
+return {state, event}
+"""
+
 
 class CircuitState(str, Enum):
     CLOSED = "closed"
@@ -38,6 +105,12 @@ class CircuitBreaker:
         open_duration: seconds to stay OPEN before moving to HALF_OPEN
         window_size: rolling window in seconds for failure rate calculation
         redis_client: optional async Redis client for shared state
+        state_cache_ttl: seconds a CLOSED/OPEN state read from Redis is reused
+            before asking again (0 reads it on every call)
+
+    The in-process state needs no lock: every transition runs without an
+    ``await`` between reading and writing state, so steps on one event loop
+    cannot interleave.
     """
 
     def __init__(
@@ -48,6 +121,7 @@ class CircuitBreaker:
         open_duration: float = 30.0,
         window_size: float = 60.0,
         redis_client: Any = None,
+        state_cache_ttl: float = 0.0,
     ) -> None:
         self.name = name
         self.failure_threshold = failure_threshold
@@ -55,13 +129,30 @@ class CircuitBreaker:
         self.open_duration = open_duration
         self.window_size = window_size
         self._redis = redis_client
+        self.state_cache_ttl = state_cache_ttl
+        # Monotonic time of the last shared state read (see _get_state)
+        self._shared_checked_at = float("-inf")
+        # Monotonic time until which Redis is skipped after an error
+        self._redis_down_until = 0.0
+        self._retry_after = str(int(open_duration))
 
         # In-process fallback state
         self._state = CircuitState.CLOSED
-        self._failures: list[float] = []  # timestamps
+        # Rolling failure window as a ring of per-slice counters: constant
+        # memory however many failures arrive.  _bucket_head is the absolute
+        # slice index (monotonic time // slice width) of the newest bucket.
+        self._buckets = [0] * WINDOW_BUCKETS
+        self._bucket_width = window_size / WINDOW_BUCKETS
+        self._bucket_head = 0
         self._successes_in_half_open = 0
         self._opened_at: Optional[float] = None
-        self._lock = asyncio.Lock()
+        # True while the one HALF_OPEN probe call of this process is running
+        self._probe_in_flight = False
+
+        # Shared state: register_script only hashes the source locally; the
+        # script is loaded into Redis on first use and invoked by SHA after.
+        self._script = redis_client.register_script(_BREAKER_LUA) if redis_client else None
+        self._redis_keys = [f"breaker:{name}:state", f"breaker:{name}:failures"]
 
         BREAKER_STATE.labels(downstream=name).set(0)  # 0=closed
 
@@ -80,16 +171,15 @@ class CircuitBreaker:
                 extra={"breaker": self.name},
             )
             BREAKER_STATE.labels(downstream=self.name).set(1)  # 1=open
-            if fallback:
-                return await fallback()
-            from fastapi import HTTPException
-            raise HTTPException(
-                status_code=503,
-                detail=f"Circuit breaker OPEN for {self.name}",
-                headers={"Retry-After": str(int(self.open_duration))},
-            )
+            return await self._reject(fallback)
 
+        probing = False
         if state == CircuitState.HALF_OPEN:
+            # Admit a single probe; concurrent callers are turned away as if
+            # the breaker were still open.
+            if self._probe_in_flight:
+                return await self._reject(fallback)
+            self._probe_in_flight = probing = True
             BREAKER_STATE.labels(downstream=self.name).set(2)  # 2=half_open
 
         try:
@@ -99,41 +189,117 @@ class CircuitBreaker:
         except Exception as exc:
             await self._on_failure()
             raise
+        finally:
+            if probing:
+                self._probe_in_flight = False
+
+    async def _reject(self, fallback: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        if fallback:
+            return await fallback()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Circuit breaker OPEN for {self.name}",
+            headers={"Retry-After": self._retry_after},
+        )
+
+    async def _shared_step(self, op: str) -> Optional[CircuitState]:
+        """Run one step of the Redis-backed state machine.
+
+        Mirrors the shared state into the in-process fields (so ``state`` and
+        the metrics stay current) and returns it, or returns None when Redis
+        is unavailable so the caller falls back to in-process state.
+        """
+        if self._script is None or time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            state, event = await self._script(
+                keys=self._redis_keys,
+                args=[
+                    op,
+                    self.failure_threshold,
+                    self.success_threshold,
+                    self.window_size,
+                    self.open_duration,
+                    uuid.uuid4().hex if op == "failure" else "",
+                ],
+            )
+        except Exception as exc:
+            self._redis_down_until = time.monotonic() + REDIS_ERROR_COOLDOWN
+            logger.warning(
+                "circuit_breaker_redis_error",
+                extra={"breaker": self.name, "error": str(exc)},
+            )
+            return None
+
+        if isinstance(state, bytes):
+            state, event = state.decode(), event.decode()
+        if event == "tripped":
+            self._trip(time.monotonic())
+        elif state == CircuitState.OPEN and self._state != CircuitState.OPEN:
+            # Opened by another replica (or before this process started):
+            # start the local open clock now, so the in-process fallback can
+            # still reach HALF_OPEN if Redis goes away while OPEN.
+            self._opened_at = time.monotonic()
+            BREAKER_STATE.labels(downstream=self.name).set(1)
+        elif event == "half_open":
+            logger.info("circuit_breaker_half_open", extra={"breaker": self.name})
+        elif event == "closed":
+            logger.info("circuit_breaker_closed", extra={"breaker": self.name})
+            BREAKER_STATE.labels(downstream=self.name).set(0)
+        self._state = CircuitState(state)
+        return self._state
 
     async def _get_state(self) -> CircuitState:
-        async with self._lock:
-            if self._state == CircuitState.OPEN:
-                if self._opened_at and (time.monotonic() - self._opened_at) >= self.open_duration:
-                    logger.info("circuit_breaker_half_open", extra={"breaker": self.name})
-                    self._state = CircuitState.HALF_OPEN
-                    self._successes_in_half_open = 0
-            elif self._state == CircuitState.CLOSED:
-                self._prune_window()
-            return self._state
+        if self._script is not None:
+            now = time.monotonic()
+            # HALF_OPEN is never served from the cache: probe admission
+            # depends on the current shared state.
+            if (
+                self._state != CircuitState.HALF_OPEN
+                and now - self._shared_checked_at < self.state_cache_ttl
+            ):
+                return self._state
+            shared = await self._shared_step("check")
+            if shared is not None:
+                self._shared_checked_at = now
+                return shared
+        if self._state == CircuitState.OPEN:
+            if self._opened_at and (time.monotonic() - self._opened_at) >= self.open_duration:
+                logger.info("circuit_breaker_half_open", extra={"breaker": self.name})
+                self._state = CircuitState.HALF_OPEN
+                self._successes_in_half_open = 0
+        return self._state
 
     async def _on_success(self) -> None:
-        async with self._lock:
-            if self._state == CircuitState.HALF_OPEN:
-                self._successes_in_half_open += 1
-                if self._successes_in_half_open >= self.success_threshold:
-                    logger.info("circuit_breaker_closed", extra={"breaker": self.name})
-                    self._state = CircuitState.CLOSED
-                    self._failures = []
-                    BREAKER_STATE.labels(downstream=self.name).set(0)
-            elif self._state == CircuitState.CLOSED:
-                pass  # normal
+        # Only a HALF_OPEN success changes shared state; skip the round trip
+        # for the common CLOSED case.
+        if self._script is not None and self._state == CircuitState.CLOSED:
+            return
+        if await self._shared_step("success") is not None:
+            return
+        if self._state == CircuitState.HALF_OPEN:
+            self._successes_in_half_open += 1
+            if self._successes_in_half_open >= self.success_threshold:
+                logger.info("circuit_breaker_closed", extra={"breaker": self.name})
+                self._state = CircuitState.CLOSED
+                self._buckets = [0] * WINDOW_BUCKETS
+                BREAKER_STATE.labels(downstream=self.name).set(0)
+        elif self._state == CircuitState.CLOSED:
+            pass  # normal
 
     async def _on_failure(self) -> None:
-        async with self._lock:
-            now = time.monotonic()
-            if self._state == CircuitState.HALF_OPEN:
-                # Single failure in half-open re-opens the breaker
-                self._trip(now)
-                return
-            self._failures.append(now)
-            self._prune_window()
-            if len(self._failures) >= self.failure_threshold:
-                self._trip(now)
+        if await self._shared_step("failure") is not None:
+            self._shared_checked_at = time.monotonic()
+            return
+        now = time.monotonic()
+        if self._state == CircuitState.HALF_OPEN:
+            # Single failure in half-open re-opens the breaker
+            self._trip(now)
+            return
+        self._advance_window(now)
+        self._buckets[self._bucket_head % WINDOW_BUCKETS] += 1
+        if sum(self._buckets) >= self.failure_threshold:
+            self._trip(now)
 
     def _trip(self, now: float) -> None:
         self._state = CircuitState.OPEN
@@ -142,9 +308,13 @@ class CircuitBreaker:
         BREAKER_OPEN_TOTAL.labels(downstream=self.name).inc()
         logger.error("circuit_breaker_tripped", extra={"breaker": self.name})
 
-    def _prune_window(self) -> None:
-        cutoff = time.monotonic() - self.window_size
-        self._failures = [t for t in self._failures if t > cutoff]
+    def _advance_window(self, now: float) -> None:
+        """Rotate the ring to *now*, zeroing slices that fell out of the window."""
+        head = int(now // self._bucket_width)
+        stale = min(head - self._bucket_head, WINDOW_BUCKETS)
+        for i in range(1, stale + 1):
+            self._buckets[(self._bucket_head + i) % WINDOW_BUCKETS] = 0
+        self._bucket_head = max(head, self._bucket_head)
 
     @property
     def state(self) -> CircuitState:
@@ -8,19 +8,21 @@ Enforces idempotency on write endpoints (POST/PUT/PATCH) by:
 
 If Redis is unavailable the middleware passes the request through (fail open)
 to avoid availability sacrifice for idempotency guarantees.
+
+The store should be given the service's process-wide Redis client, the same
+one (and so the same connection pool) its circuit breakers use.
 """
 from __future__ import annotations
 
 import asyncio
 import hashlib
-import json
 import logging
 import time
 from typing import Any, Optional
 
+import orjson
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.responses import JSONResponse
 
 from libs.observability.metrics import IDEMPOTENCY_HITS, IDEMPOTENCY_CONFLICTS
 
@@ -29,13 +31,74 @@ logger = logging.getLogger(__name__)
 IDEMPOTENCY_HEADER = "Idempotency-Key"
 DEFAULT_TTL = 86400  # 24 hours – long enough to cover any client retry window
 
+# Bodies of the fixed error responses, encoded once.  Each request still gets
+# a fresh Response, since outer middleware may add headers to it.
+_MISSING_KEY_BODY = orjson.dumps({"detail": f"Missing {IDEMPOTENCY_HEADER} header"})
+_IN_FLIGHT_BODY = orjson.dumps({"detail": "Duplicate request in-flight"})
+
+# Strong references to fire-and-forget tasks so they aren't GC'd mid-flight
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _fingerprint(idempotency_key: str, body: bytes) -> str:
+    """Hash Idempotency-Key + request body into a fixed-size store key.
+
+    BLAKE2b is in hashlib and faster than SHA-256 on 64-bit CPUs.
+    """
+    h = hashlib.blake2b(idempotency_key.encode(), digest_size=16)
+    h.update(b"\0")
+    h.update(body)
+    return h.hexdigest()
+
+
+def _missing_key_response() -> Response:
+    return Response(_MISSING_KEY_BODY, status_code=400, media_type="application/json")
+
+
+def _in_flight_response() -> Response:
+    return Response(
+        _IN_FLIGHT_BODY,
+        status_code=409,
+        media_type="application/json",
+        headers={"Retry-After": "2"},
+    )
+
+
+def _spawn(coro: Any) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 
 class IdempotencyStore:
-    """Redis-backed idempotency store."""
+    """Redis-backed idempotency store.
+
+    Once :meth:`start` has been called (from the service lifespan), responses
+    passed to :meth:`finalize` are queued and written by a background task,
+    which coalesces everything arriving within *flush_interval_ms* into one
+    pipeline of at most *max_batch* entries.  The processing lock is held
+    until the flush, so a duplicate arriving in that window gets the usual
+    409 rather than a second execution.  When the queue is full, or before
+    :meth:`start`, :meth:`finalize` writes through directly.
+    """
 
-    def __init__(self, redis_client: Any, ttl: int = DEFAULT_TTL) -> None:
+    def __init__(
+        self,
+        redis_client: Any,
+        ttl: int = DEFAULT_TTL,
+        flush_interval_ms: float = 5,
+        max_batch: int = 128,
+        max_pending: int = 4096,
+    ) -> None:
         self._redis = redis_client
         self._ttl = ttl
+        self._flush_interval = flush_interval_ms / 1000
+        self._max_batch = max_batch
+        self._pending: asyncio.Queue[tuple[str, bytes]] = asyncio.Queue(maxsize=max_pending)
+        self._flusher: Optional[asyncio.Task] = None
+        # Entries the flusher has dequeued but not yet written; stop() writes
+        # them if the flusher is cancelled mid-window.
+        self._in_hand: list[tuple[str, bytes]] = []
 
     def _key(self, idempotency_key: str) -> str:
         return f"idempotency:{idempotency_key}"
@@ -43,21 +106,36 @@ class IdempotencyStore:
     def _lock_key(self, idempotency_key: str) -> str:
         return f"idempotency_lock:{idempotency_key}"
 
-    async def get(self, idempotency_key: str) -> Optional[dict]:
+    # Entries are stored as a 3-digit ASCII status code followed by the raw
+    # response body, so replays need no JSON decode/encode.  ASCII keeps the
+    # value readable by clients created with decode_responses=True.
+
+    @staticmethod
+    def _decode(raw: Any) -> Optional[tuple[int, bytes]]:
+        if not raw:
+            return None
+        if isinstance(raw, str):
+            raw = raw.encode()
         try:
-            raw = await self._redis.get(self._key(idempotency_key))
-            if raw:
-                return json.loads(raw)
+            return int(raw[:3]), raw[3:]
+        except ValueError:
+            logger.warning("idempotency_store_bad_entry")
+            return None
+
+    async def get(self, idempotency_key: str) -> Optional[tuple[int, bytes]]:
+        """Return the cached ``(status_code, body)`` for *idempotency_key*, if any."""
+        try:
+            return self._decode(await self._redis.get(self._key(idempotency_key)))
         except Exception as exc:
             logger.warning("idempotency_store_read_error", extra={"error": str(exc)})
         return None
 
-    async def set(self, idempotency_key: str, response_data: dict) -> None:
+    async def set(self, idempotency_key: str, status_code: int, body: bytes) -> None:
         try:
             await self._redis.setex(
                 self._key(idempotency_key),
                 self._ttl,
-                json.dumps(response_data),
+                b"%03d" % status_code + body,
             )
         except Exception as exc:
             logger.warning("idempotency_store_write_error", extra={"error": str(exc)})
@@ -76,6 +154,83 @@ class IdempotencyStore:
             logger.warning("idempotency_lock_error", extra={"error": str(exc)})
             return True  # fail open
 
+    async def get_and_lock(
+        self, idempotency_key: str, timeout: int = 30
+    ) -> tuple[Optional[tuple[int, bytes]], bool]:
+        """Fetch the cached response and try the processing lock in one round trip.
+
+        Returns ``(cached, acquired)``.  Fails open like :meth:`get` and
+        :meth:`acquire_lock`: on Redis errors the result is ``(None, True)``.
+        """
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.get(self._key(idempotency_key))
+                pipe.set(self._lock_key(idempotency_key), "1", nx=True, ex=timeout)
+                raw, locked = await pipe.execute()
+        except Exception as exc:
+            logger.warning("idempotency_store_read_error", extra={"error": str(exc)})
+            return None, True
+        return self._decode(raw), locked is True
+
+    async def finalize(self, idempotency_key: str, status_code: int, body: bytes) -> None:
+        """Store the response and release the processing lock in one round trip."""
+        entry = (idempotency_key, b"%03d" % status_code + body)
+        if self._flusher is not None:
+            try:
+                self._pending.put_nowait(entry)
+                return
+            except asyncio.QueueFull:
+                pass  # backlogged: write through
+        await self._write_batch([entry])
+
+    async def _write_batch(self, batch: list[tuple[str, bytes]]) -> None:
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for idempotency_key, value in batch:
+                    pipe.setex(self._key(idempotency_key), self._ttl, value)
+                    pipe.delete(self._lock_key(idempotency_key))
+                await pipe.execute()
+        except Exception as exc:
+            # The locks expire on their own timeout
+            logger.warning(
+                "idempotency_store_write_error",
+                extra={"error": str(exc), "batch_size": len(batch)},
+            )
+
+    async def _flush_loop(self) -> None:
+        queue = self._pending
+        while True:
+            batch = self._in_hand = [await queue.get()]
+            # Let the window fill before writing
+            await asyncio.sleep(self._flush_interval)
+            while len(batch) < self._max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            await self._write_batch(batch)
+            self._in_hand = []
+
+    def start(self) -> None:
+        """Start the background flusher; call from the service lifespan."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out whatever is still queued."""
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        self._flusher = None
+        # A batch cut off mid-write is simply written again (SETEX/DEL are
+        # idempotent)
+        batch, self._in_hand = self._in_hand, []
+        while not self._pending.empty():
+            batch.append(self._pending.get_nowait())
+        if batch:
+            await self._write_batch(batch)
+
     async def release_lock(self, idempotency_key: str) -> None:
         try:
             await self._redis.delete(self._lock_key(idempotency_key))
@@ -90,7 +245,7 @@ class IdempotencyMiddleware(BaseHTTPMiddleware):
     Paths listed in *skip_paths* are also skipped (e.g. /health, /metrics).
     """
 
-    MUTATING_METHODS = {"POST", "PUT", "PATCH"}
+    MUTATING_METHODS = frozenset({"POST", "PUT", "PATCH"})
 
     def __init__(
         self,
@@ -101,73 +256,79 @@ class IdempotencyMiddleware(BaseHTTPMiddleware):
     ) -> None:
         super().__init__(app)
         self._store = store
-        self._skip_paths = set(skip_paths or ["/health", "/metrics", "/ready"])
+        self._skip_paths = frozenset(skip_paths or ["/health", "/metrics", "/ready"])
         self._require_key = require_key
 
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        if request.method not in self.MUTATING_METHODS:
+        # Read the raw ASGI scope; request.url builds a URL object per request
+        scope = request.scope
+        if scope["method"] not in self.MUTATING_METHODS:
             return await call_next(request)
-        if request.url.path in self._skip_paths:
+        path = scope["path"]
+        if path in self._skip_paths:
             return await call_next(request)
 
         idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
 
         if not idempotency_key:
             if self._require_key:
-                return JSONResponse(
-                    {"detail": f"Missing {IDEMPOTENCY_HEADER} header"},
-                    status_code=400,
-                )
+                return _missing_key_response()
             # Not required – pass through
             return await call_next(request)
 
-        # Check for cached response
-        cached = await self._store.get(idempotency_key)
+        # Key the cache on key + body, so a reused Idempotency-Key with a
+        # different payload is not answered with another request's response.
+        # (Starlette caches the body, so the endpoint can still read it.)
+        store_key = _fingerprint(idempotency_key, await request.body())
+
+        # Check for a cached response and take the processing lock together
+        cached, acquired = await self._store.get_and_lock(store_key)
         if cached:
-            IDEMPOTENCY_HITS.labels(service=request.url.path).inc()
+            if acquired:
+                # The response already exists, so the lock is moot; drop it
+                # without holding up the replay.
+                _spawn(self._store.release_lock(store_key))
+            IDEMPOTENCY_HITS.labels(service=path).inc()
             logger.info(
                 "idempotency_cache_hit",
-                extra={"idempotency_key": idempotency_key, "path": request.url.path},
+                extra={"idempotency_key": idempotency_key, "path": path},
             )
-            return JSONResponse(
-                content=cached["body"],
-                status_code=cached["status_code"],
+            status_code, body = cached
+            return Response(
+                content=body,
+                status_code=status_code,
+                media_type="application/json",
                 headers={"X-Idempotency-Replayed": "true"},
             )
 
-        # Try to acquire processing lock for concurrent duplicates
-        acquired = await self._store.acquire_lock(idempotency_key)
         if not acquired:
-            IDEMPOTENCY_CONFLICTS.labels(service=request.url.path).inc()
+            IDEMPOTENCY_CONFLICTS.labels(service=path).inc()
             # Another request is currently being processed
-            return JSONResponse(
-                {"detail": "Duplicate request in-flight"},
-                status_code=409,
-                headers={"Retry-After": "2"},
-            )
+            return _in_flight_response()
 
+        finalized = False
         try:
             response = await call_next(request)
 
             # Cache successful (2xx) responses only
             if 200 <= response.status_code < 300:
-                body_bytes = b""
+                # bytearray grows amortised O(n); bytes += chunk recopies each time
+                buf = bytearray()
                 async for chunk in response.body_iterator:
-                    body_bytes += chunk
-
-                try:
-                    body = json.loads(body_bytes)
-                except Exception:
-                    body = body_bytes.decode("utf-8", errors="replace")
-
-                await self._store.set(
-                    idempotency_key,
-                    {"body": body, "status_code": response.status_code},
-                )
-                return JSONResponse(
-                    content=body,
-                    status_code=response.status_code,
-                )
+                    buf.extend(chunk)
+                body_bytes = bytes(buf)
+
+                # Cache the response and drop the lock together
+                await self._store.finalize(store_key, response.status_code, body_bytes)
+                finalized = True
+                # Hand back the endpoint's bytes and headers as-is rather than
+                # re-encoding; content-length still matches the same body.
+                # The raw list keeps repeated headers (e.g. Set-Cookie) that a
+                # dict would collapse.
+                replay = Response(content=body_bytes, status_code=response.status_code)
+                replay.raw_headers = list(response.headers.raw)
+                return replay
             return response
         finally:
-            await self._store.release_lock(idempotency_key)
+            if not finalized:
+                await self._store.release_lock(store_key)
@@ -40,6 +40,32 @@ class RetryConfig:
     )
     # Per-request retry budget; shared mutable int.  None = unlimited.
     retry_budget: Optional[list[int]] = None
+    # Capped exponential delay per attempt, precomputed from the fields above
+    _ladder: tuple[float, ...] = field(init=False, repr=False, compare=False)
+    # retryable_status_codes as a bitmask (bit n set = status n retryable)
+    _status_bitmap: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._ladder = tuple(
+            min(self.base_delay * (self.multiplier ** i), self.max_delay)
+            for i in range(self.max_attempts)
+        )
+        bitmap = 0
+        for status in self.retryable_status_codes:
+            bitmap |= 1 << status
+        self._status_bitmap = bitmap
+
+
+# Transient transport failures worth another attempt
+_RETRYABLE_ERRORS = (
+    httpx.ConnectError,
+    httpx.TimeoutException,
+    httpx.RemoteProtocolError,
+    ConnectionError,
+    asyncio.TimeoutError,
+)
+
+_RETRYABLE_STATUS_MSG = "Retryable status %d"
 
 
 async def retry_with_backoff(
@@ -51,86 +77,122 @@ async def retry_with_backoff(
 ) -> T:
     """Execute *func* with retry logic defined by *config*.
 
+    Retries on network errors only; the return value is not inspected.  Use
+    :func:`retry_http_with_backoff` when *func* returns an ``httpx.Response``
+    whose status code should also trigger a retry.
+
     Raises the last exception after exhausting attempts.
     """
     last_exc: Optional[Exception] = None
 
     for attempt in range(config.max_attempts):
-        # Check shared retry budget
-        if config.retry_budget is not None and config.retry_budget[0] <= 0:
-            logger.warning(
-                "retry_budget_exhausted",
-                extra={"service": service_name, "operation": operation},
+        if _budget_exhausted(config, service_name, operation):
+            raise last_exc or RuntimeError("Retry budget exhausted")
+
+        try:
+            return await func()
+        except _RETRYABLE_ERRORS as exc:
+            last_exc = exc
+            if attempt >= config.max_attempts - 1:
+                raise
+            await _wait_before_retry(
+                attempt, config, service_name, operation,
+                "retrying_after_error", error=str(exc),
             )
+
+    raise last_exc or RuntimeError("Retry failed without exception")
+
+
+async def retry_http_with_backoff(
+    func: Callable[[], Awaitable[httpx.Response]],
+    config: RetryConfig,
+    *,
+    service_name: str = "unknown",
+    operation: str = "unknown",
+) -> httpx.Response:
+    """Like :func:`retry_with_backoff`, for callables returning ``httpx.Response``.
+
+    Additionally retries responses whose status is in
+    ``config.retryable_status_codes``; the last such response is returned
+    as-is once attempts run out.
+    """
+    last_exc: Optional[Exception] = None
+
+    for attempt in range(config.max_attempts):
+        if _budget_exhausted(config, service_name, operation):
             raise last_exc or RuntimeError("Retry budget exhausted")
 
         try:
             result = await func()
-            # If result is an httpx.Response, check the status code
-            if isinstance(result, httpx.Response):
-                if result.status_code in config.retryable_status_codes:
-                    if attempt < config.max_attempts - 1:
-                        delay = _backoff_delay(attempt, config)
-                        RETRY_ATTEMPTS.labels(
-                            service=service_name, operation=operation
-                        ).inc()
-                        logger.info(
-                            "retrying_request",
-                            extra={
-                                "attempt": attempt + 1,
-                                "status_code": result.status_code,
-                                "delay": delay,
-                                "service": service_name,
-                                "operation": operation,
-                            },
-                        )
-                        if config.retry_budget is not None:
-                            config.retry_budget[0] -= 1
-                        await asyncio.sleep(delay)
-                        last_exc = httpx.HTTPStatusError(
-                            f"Retryable status {result.status_code}",
-                            request=result.request,
-                            response=result,
-                        )
-                        continue
-            return result
-        except (
-            httpx.ConnectError,
-            httpx.TimeoutException,
-            httpx.RemoteProtocolError,
-            ConnectionError,
-            asyncio.TimeoutError,
-        ) as exc:
+        except _RETRYABLE_ERRORS as exc:
             last_exc = exc
-            if attempt < config.max_attempts - 1:
-                delay = _backoff_delay(attempt, config)
-                RETRY_ATTEMPTS.labels(
-                    service=service_name, operation=operation
-                ).inc()
-                logger.info(
-                    "retrying_after_error",
-                    extra={
-                        "attempt": attempt + 1,
-                        "error": str(exc),
-                        "delay": delay,
-                        "service": service_name,
-                        "operation": operation,
-                    },
-                )
-                if config.retry_budget is not None:
-                    config.retry_budget[0] -= 1
-                await asyncio.sleep(delay)
-            else:
+            if attempt >= config.max_attempts - 1:
                 raise
-        except Exception:
-            raise  # non-retryable
+            await _wait_before_retry(
+                attempt, config, service_name, operation,
+                "retrying_after_error", error=str(exc),
+            )
+            continue
+
+        if (
+            (config._status_bitmap >> result.status_code) & 1
+            and attempt < config.max_attempts - 1
+        ):
+            await _wait_before_retry(
+                attempt, config, service_name, operation,
+                "retrying_request", status_code=result.status_code,
+            )
+            last_exc = httpx.HTTPStatusError(
+                _RETRYABLE_STATUS_MSG % result.status_code,
+                request=result.request,
+                response=result,
+            )
+            continue
+        return result
 
     raise last_exc or RuntimeError("Retry failed without exception")
 
 
+def _budget_exhausted(config: RetryConfig, service_name: str, operation: str) -> bool:
+    """Check the shared retry budget, logging when it has run out."""
+    if config.retry_budget is not None and config.retry_budget[0] <= 0:
+        logger.warning(
+            "retry_budget_exhausted",
+            extra={"service": service_name, "operation": operation},
+        )
+        return True
+    return False
+
+
+async def _wait_before_retry(
+    attempt: int,
+    config: RetryConfig,
+    service_name: str,
+    operation: str,
+    event: str,
+    **detail: object,
+) -> None:
+    """Record a retry, charge the budget and sleep for the backoff delay."""
+    delay = _backoff_delay(attempt, config)
+    RETRY_ATTEMPTS.labels(service=service_name, operation=operation).inc()
+    logger.info(
+        event,
+        extra={
+            "attempt": attempt + 1,
+            **detail,
+            "delay": delay,
+            "service": service_name,
+            "operation": operation,
+        },
+    )
+    if config.retry_budget is not None:
+        config.retry_budget[0] -= 1
+    await asyncio.sleep(delay)
+
+
 def _backoff_delay(attempt: int, config: RetryConfig) -> float:
     """Compute exponential backoff with optional full jitter."""
-    base = min(config.base_delay * (config.multiplier ** attempt), config.max_delay)
+    base = config._ladder[attempt]
     if config.jitter:
-        return random.uniform(0, base)
+        return random.random() * base
     return base
@@ -63,7 +63,9 @@ async def with_timeout(
 ) -> Any:
     """Run *func* with a hard timeout, raising asyncio.TimeoutError on breach."""
     try:
-        return await asyncio.wait_for(func(), timeout=timeout_seconds)
+        # Deadline on the current task; wait_for would wrap func() in a new one
+        async with asyncio.timeout(timeout_seconds):
+            return await func()
     except asyncio.TimeoutError:
         logger.warning(
             "operation_timed_out",
@@ -8,7 +8,6 @@ Simulates stock reservation with:
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import os
 import random
@@ -18,16 +17,17 @@ from contextlib import asynccontextmanager
 from typing import Optional
 
 import asyncpg
+import orjson
 import redis.asyncio as aioredis
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from prometheus_client import make_asgi_app
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel, Field
 
-import sys
-sys.path.insert(0, "/app")
-
-from libs.observability import setup_logging, setup_tracing, ObservabilityMiddleware
+from libs.observability import (
+    setup_logging,
+    setup_tracing,
+    ObservabilityMiddleware,
+    cached_metrics_app,
+)
 from libs.observability.metrics import DUPLICATE_WRITE_RATE
 
 setup_logging(os.getenv("LOG_LEVEL", "INFO"))
@@ -39,6 +39,10 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/2")
 
 _db_pool: Optional[asyncpg.Pool] = None
 _redis: Optional[aioredis.Redis] = None
+# Strong references to fire-and-forget tasks so they aren't GC'd mid-flight
+_background_tasks: set[asyncio.Task] = set()
+# Generator for chaos draws, separate from the shared module-level one
+_rng = random.Random()
 
 CREATE_TABLES_SQL = """
 CREATE TABLE IF NOT EXISTS products (
@@ -71,14 +75,116 @@ INSERT INTO products (id, name, stock) VALUES
 ON CONFLICT (id) DO NOTHING;
 """
 
+# Reserve every item of an order in one statement: lock the products, check
+# stock per product (quantities of repeated items summed), then insert the
+# reservations and bump products.reserved only if nothing is short.  Unknown
+# products are let through (demo).  Returns the first short product, if any.
+#   $1 reservation ids  $2 product ids  $3 quantities  $4 order id
+#   $5 idempotency key (NULL for none)
+RESERVE_SQL = """
+WITH req AS (
+    SELECT * FROM unnest($1::uuid[], $2::text[], $3::int[])
+        WITH ORDINALITY AS r(res_id, product_id, quantity, ord)
+),
+wanted AS (
+    SELECT product_id, sum(quantity)::int AS quantity, min(ord) AS ord
+    FROM req GROUP BY product_id
+),
+locked AS (
+    SELECT id, stock - reserved AS available
+    FROM products WHERE id = ANY($2::text[])
+    ORDER BY id  -- one global lock order, so concurrent orders cannot deadlock
+    FOR UPDATE
+),
+short AS (
+    SELECT w.product_id, l.available, w.quantity AS requested, w.ord
+    FROM wanted w JOIN locked l ON l.id = w.product_id
+    WHERE l.available < w.quantity
+),
+ins AS (
+    INSERT INTO reservations (id, order_id, product_id, quantity, idempotency_key)
+    SELECT res_id, $4::text, product_id, quantity, $5::text || ':' || product_id
+    FROM req
+    WHERE NOT EXISTS (SELECT 1 FROM short)
+    ON CONFLICT DO NOTHING
+),
+upd AS (
+    UPDATE products p SET reserved = p.reserved + w.quantity
+    FROM wanted w
+    WHERE p.id = w.product_id AND NOT EXISTS (SELECT 1 FROM short)
+)
+SELECT product_id, available, requested FROM short ORDER BY ord LIMIT 1
+"""
+
+# Single-product orders (the common case) skip the lock step: one
+# compare-and-set UPDATE checks and bumps products.reserved atomically, and the
+# reservations are inserted only if it matched.  Same parameters and result
+# as RESERVE_SQL.
+RESERVE_ONE_SQL = """
+WITH req AS (
+    SELECT * FROM unnest($1::uuid[], $2::text[], $3::int[])
+        AS r(res_id, product_id, quantity)
+),
+wanted AS (
+    SELECT min(product_id) AS product_id, sum(quantity)::int AS quantity FROM req
+),
+upd AS (
+    UPDATE products p SET reserved = p.reserved + w.quantity
+    FROM wanted w
+    WHERE p.id = w.product_id AND p.stock - p.reserved >= w.quantity
+    RETURNING p.id
+),
+short AS (
+    SELECT w.product_id, p.stock - p.reserved AS available, w.quantity AS requested
+    FROM wanted w JOIN products p ON p.id = w.product_id
+    WHERE NOT EXISTS (SELECT 1 FROM upd)
+),
+ins AS (
+    INSERT INTO reservations (id, order_id, product_id, quantity, idempotency_key)
+    SELECT res_id, $4::text, product_id, quantity, $5::text || ':' || product_id
+    FROM req
+    WHERE NOT EXISTS (SELECT 1 FROM short)
+    ON CONFLICT DO NOTHING
+)
+SELECT product_id, available, requested FROM short
+"""
+
+
+async def _prepare_statements(conn: asyncpg.Connection) -> None:
+    """Prime a new connection's statement cache with the reserve statements.
+
+    asyncpg prepares each distinct query once per connection and reuses it
+    from its LRU cache; running them here (with empty arrays they touch no
+    rows) moves that parse/plan step off the first reservations served by
+    each connection.
+    """
+    for sql in (RESERVE_SQL, RESERVE_ONE_SQL):
+        await conn.fetchrow(sql, [], [], [], "", None)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _db_pool, _redis
-    _db_pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10)
-    async with _db_pool.acquire() as conn:
+    global _db_pool, _redis, _idem_claim
+    # Schema first: the pool's init prepares statements against these tables
+    conn = await asyncpg.connect(DB_DSN)
+    try:
         await conn.execute(CREATE_TABLES_SQL)
-    _redis = await aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    finally:
+        await conn.close()
+    _db_pool = await asyncpg.create_pool(
+        DB_DSN,
+        min_size=10,
+        max_size=50,
+        max_inactive_connection_lifetime=300,
+        command_timeout=5,
+        statement_cache_size=1024,
+        # JIT compilation costs more than it saves on sub-millisecond OLTP plans
+        server_settings={"jit": "off", "application_name": SERVICE_NAME},
+        init=_prepare_statements,
+    )
+    # Raw bytes: cached replies go back out as-is and float() parses bytes
+    _redis = await aioredis.from_url(REDIS_URL, decode_responses=False)
+    _idem_claim = _redis.register_script(IDEM_CLAIM_LUA)
     logger.info("inventory_service_started")
     yield
     await _redis.aclose()
@@ -87,7 +193,7 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="Inventory Service", version="1.0.0", lifespan=lifespan)
 app.add_middleware(ObservabilityMiddleware, service_name=SERVICE_NAME)
-app.mount("/metrics", make_asgi_app())
+app.mount("/metrics", cached_metrics_app())
 
 setup_tracing(SERVICE_NAME)
 
@@ -102,18 +208,94 @@ class ReserveRequest(BaseModel):
     items: list[ReserveItem]
 
 
-async def _get_chaos_config() -> dict:
-    if _redis:
-        try:
-            lock_ms = await _redis.get("chaos:inventory:lock_contention_ms")
-            fail_rate = await _redis.get("chaos:inventory:error_rate")
-            return {
-                "lock_contention_ms": float(lock_ms) if lock_ms else 0.0,
-                "error_rate": float(fail_rate) if fail_rate else 0.0,
-            }
-        except Exception:
-            pass
-    return {"lock_contention_ms": 0.0, "error_rate": 0.0}
+CHAOS_KEYS = ("chaos:inventory:lock_contention_ms", "chaos:inventory:error_rate")
+CHAOS_CACHE_TTL = 1.0  # seconds; bursts of requests share one Redis read
+_NO_CHAOS = {"lock_contention_ms": 0.0, "error_rate": 0.0}
+
+# (config, monotonic expiry) of the last chaos config read from Redis
+_chaos_cache: tuple[dict, float] = ({}, 0.0)
+
+
+def _parse_chaos(lock_ms: Optional[bytes], fail_rate: Optional[bytes]) -> dict:
+    return {
+        "lock_contention_ms": float(lock_ms) if lock_ms else 0.0,
+        "error_rate": float(fail_rate) if fail_rate else 0.0,
+    }
+
+
+IDEM_TTL = 86400          # seconds a finished reservation is replayable
+IDEM_INFLIGHT_TTL = 60    # seconds a claim survives a crashed handler
+IDEM_INFLIGHT = b"INFLIGHT"
+
+# Atomically read the idempotency entry and, if absent, claim it with the
+# in-flight marker, so concurrent duplicates cannot both reach the DB.  Any
+# further KEYS (the chaos config) are read in the same call.
+#   KEYS[1] idempotency key  KEYS[2..] extra keys to GET   ARGV[1] claim TTL
+# Returns {entry or nil, extra values...}.
+IDEM_CLAIM_LUA = """
+local v = redis.call('GET', KEYS[1])
+if not v then
+    redis.call('SET', KEYS[1], 'INFLIGHT', 'EX', ARGV[1])
+end
+local out = {v}
+for i = 2, #KEYS do
+    out[i] = redis.call('GET', KEYS[i])
+end
+return out
+"""
+
+# Set in lifespan: IDEM_CLAIM_LUA registered on _redis (invoked by SHA)
+_idem_claim = None
+
+
+async def _claim_and_get_chaos(idem_key: Optional[str]) -> tuple[Optional[bytes], dict]:
+    """Claim *idem_key* (if any) and fetch the chaos config in one round trip.
+
+    Returns the existing idempotency entry (a cached response or
+    IDEM_INFLIGHT), or None when this call claimed the key.  The chaos keys
+    are only read when the cached config has expired.
+    """
+    global _chaos_cache
+    if _redis is None:
+        return None, _NO_CHAOS
+    config, expires_at = _chaos_cache
+    now = time.monotonic()
+    fresh = now < expires_at
+    if fresh and not idem_key:
+        return None, config
+
+    extra = () if fresh else CHAOS_KEYS
+    try:
+        if idem_key:
+            values = await _idem_claim(keys=[idem_key, *extra], args=[IDEM_INFLIGHT_TTL])
+        else:
+            values = [None, *await _redis.mget(*extra)]
+    except Exception:
+        return None, config if fresh else _NO_CHAOS
+    if not fresh:
+        config = _parse_chaos(*values[1:])
+        _chaos_cache = (config, now + CHAOS_CACHE_TTL)
+    return values[0], config
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _cache_result(idem_key: str, body: bytes) -> None:
+    try:
+        await _redis.setex(idem_key, IDEM_TTL, body)
+    except Exception as exc:
+        logger.warning("idempotency_cache_write_error", extra={"error": str(exc)})
+
+
+async def _release_claim(idem_key: str) -> None:
+    try:
+        await _redis.delete(idem_key)
+    except Exception as exc:
+        logger.warning("idempotency_release_error", extra={"error": str(exc)})
 
 
 @app.get("/health")
@@ -122,84 +304,113 @@ async def health():
 
 
 @app.post("/inventory/reserve", status_code=200)
-async def reserve(req: ReserveRequest, request: Request):
+async def reserve(req: ReserveRequest, request: Request, background: BackgroundTasks):
     if _db_pool is None:
         raise HTTPException(status_code=503, detail="DB not ready")
 
     idempotency_key = request.headers.get("Idempotency-Key")
+    idem_key = f"idem:inventory:{idempotency_key}" if idempotency_key else None
+
+    # Idempotency check-and-claim, together with the chaos config lookup
+    cached, chaos = await _claim_and_get_chaos(idem_key)
+    if cached == IDEM_INFLIGHT:
+        DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="reserve").inc()
+        raise HTTPException(
+            status_code=409,
+            detail="Duplicate request in-flight",
+            headers={"Retry-After": "2"},
+        )
+    if cached:
+        DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="reserve").inc()
+        # Already serialised JSON; hand it back without a decode/encode cycle
+        return Response(cached, media_type="application/json",
+                        headers={"X-Idempotency-Replayed": "true"})
+
+    try:
+        result = await _reserve_items(req, idempotency_key, chaos)
+    except BaseException:
+        # Nothing to replay: free the key before answering, so a client
+        # retrying on the error is not met with a 409 for its own claim
+        if idem_key and _redis:
+            await _release_claim(idem_key)
+        raise
+
+    if idem_key and _redis:
+        # Replace the claim off the response path; if this write is lost the
+        # claim expires and a retry re-runs the reservation.
+        _spawn(_cache_result(idem_key, orjson.dumps(result)))
+
+    # Logged after the response has been sent
+    background.add_task(logger.info, "inventory_reserved", extra={
+        "order_id": req.order_id,
+        "items": len(req.items),
+    })
+    return result
 
-    # Idempotency check
-    if idempotency_key and _redis:
-        cached = await _redis.get(f"idem:inventory:{idempotency_key}")
-        if cached:
-            DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="reserve").inc()
-            return JSONResponse(json.loads(cached), headers={"X-Idempotency-Replayed": "true"})
 
-    chaos = await _get_chaos_config()
+async def _acquire_after(delay: float) -> asyncpg.Connection:
+    """Sleep *delay* seconds while queueing for a pool connection meanwhile.
 
-    # Simulate lock contention
-    if chaos["lock_contention_ms"] > 0:
-        jitter = chaos["lock_contention_ms"] * 0.3
-        delay = (chaos["lock_contention_ms"] + random.uniform(-jitter, jitter)) / 1000.0
+    The simulated lock wait is pure wall-clock, so under pool pressure the
+    two waits overlap instead of adding up.  The caller releases the
+    connection.
+    """
+    acquiring = asyncio.ensure_future(_db_pool.acquire())
+    try:
         await asyncio.sleep(delay)
-
-    # Simulate error injection
-    if random.random() < chaos["error_rate"]:
+        return await acquiring
+    except BaseException:
+        # Don't leak a connection that arrived while we were being cancelled
+        if acquiring.done() and not acquiring.cancelled() and acquiring.exception() is None:
+            await _db_pool.release(acquiring.result())
+        else:
+            acquiring.cancel()
+        raise
+
+
+async def _reserve_items(req: ReserveRequest, idempotency_key: Optional[str], chaos: dict) -> dict:
+    # Simulate lock contention: lock_ms ± 30%
+    lock_ms = chaos["lock_contention_ms"]
+    delay = lock_ms * (0.7 + 0.6 * _rng.random()) / 1000.0 if lock_ms > 0 else 0.0
+
+    # Simulate error injection (no draw at all when it is off).  Decided up
+    # front so a request that is going to fail never takes a connection.
+    error_rate = chaos["error_rate"]
+    if error_rate and _rng.random() < error_rate:
+        if delay:
+            await asyncio.sleep(delay)
         raise HTTPException(status_code=503, detail="Inventory DB lock timeout")
 
-    reservation_ids = []
-    async with _db_pool.acquire() as conn:
-        async with conn.transaction():
-            for item in req.items:
-                # Check stock availability
-                row = await conn.fetchrow(
-                    "SELECT stock, reserved FROM products WHERE id=$1 FOR UPDATE",
-                    item.product_id,
-                )
-                if not row:
-                    # Unknown product – still allow (demo)
-                    row = {"stock": 9999, "reserved": 0}
-
-                available = row["stock"] - row["reserved"]
-                if available < item.quantity:
-                    raise HTTPException(
-                        status_code=409,
-                        detail=f"Insufficient stock for {item.product_id}: "
-                               f"available={available}, requested={item.quantity}",
-                    )
-
-                res_id = str(uuid.uuid4())
-                await conn.execute(
-                    """
-                    INSERT INTO reservations (id, order_id, product_id, quantity, idempotency_key)
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT (idempotency_key) DO NOTHING
-                    """,
-                    res_id, req.order_id, item.product_id, item.quantity,
-                    f"{idempotency_key}:{item.product_id}" if idempotency_key else None,
-                )
-                await conn.execute(
-                    "UPDATE products SET reserved=reserved+$1 WHERE id=$2",
-                    item.quantity, item.product_id,
-                )
-                reservation_ids.append(res_id)
-
-    result = {
+    reservation_ids = [uuid.uuid4() for _ in req.items]
+    product_ids = [i.product_id for i in req.items]
+    sql = RESERVE_ONE_SQL if len(set(product_ids)) == 1 else RESERVE_SQL
+    conn = await _acquire_after(delay) if delay else await _db_pool.acquire()
+    try:
+        shortage = await conn.fetchrow(
+            sql,
+            reservation_ids,
+            product_ids,
+            [i.quantity for i in req.items],
+            req.order_id,
+            idempotency_key,
+        )
+    finally:
+        await _db_pool.release(conn)
+    if shortage:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Insufficient stock for {shortage['product_id']}: "
+                   f"available={shortage['available']}, requested={shortage['requested']}",
+        )
+
+    return {
         "order_id": req.order_id,
-        "reservation_ids": reservation_ids,
+        "reservation_ids": [str(r) for r in reservation_ids],
         "status": "reserved",
-        "items": [i.model_dump() for i in req.items],
+        # One serializer pass over the whole list rather than one call per item
+        "items": req.model_dump(include={"items"})["items"],
     }
 
-    if idempotency_key and _redis:
-        await _redis.setex(f"idem:inventory:{idempotency_key}", 86400, json.dumps(result))
-
-    logger.info("inventory_reserved", extra={
-        "order_id": req.order_id,
-        "items": len(req.items),
-    })
-    return result
-
 
 @app.get("/inventory/{product_id}")
 async def get_stock(product_id: str):
@@ -220,16 +431,20 @@ async def get_stock(product_id: str):
 
 @app.post("/chaos/config")
 async def set_chaos(lock_contention_ms: Optional[float] = None, error_rate: Optional[float] = None):
+    global _chaos_cache
     if _redis:
         if lock_contention_ms is not None:
             await _redis.set("chaos:inventory:lock_contention_ms", str(lock_contention_ms))
         if error_rate is not None:
             await _redis.set("chaos:inventory:error_rate", str(error_rate))
+    _chaos_cache = ({}, 0.0)  # other replicas pick it up within CHAOS_CACHE_TTL
     return {"status": "updated"}
 
 
 @app.delete("/chaos/config")
 async def clear_chaos():
+    global _chaos_cache
     if _redis:
-        await _redis.delete("chaos:inventory:lock_contention_ms", "chaos:inventory:error_rate")
+        await _redis.delete(*CHAOS_KEYS)
+    _chaos_cache = ({}, 0.0)
     return {"status": "cleared"}
@@ -7,24 +7,25 @@ Here it uses an in-memory queue with a swappable backend.
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import os
 import time
-from collections import deque
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from typing import Optional
 
+import orjson
 import redis.asyncio as aioredis
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from fastapi.responses import JSONResponse
-from prometheus_client import make_asgi_app
 from pydantic import BaseModel
 
-import sys
-sys.path.insert(0, "/app")
-
-from libs.observability import setup_logging, setup_tracing, ObservabilityMiddleware
+from libs.observability import (
+    setup_logging,
+    setup_tracing,
+    ObservabilityMiddleware,
+    cached_metrics_app,
+)
 from libs.observability.metrics import DUPLICATE_WRITE_RATE
 
 setup_logging(os.getenv("LOG_LEVEL", "INFO"))
@@ -32,28 +33,138 @@ logger = logging.getLogger(__name__)
 
 SERVICE_NAME = "notifications"
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/3")
+STREAM_KEY = "notifications:events"
+
+# Ingested events are published to the stream in batches: whatever arrives
+# within XADD_FLUSH_INTERVAL of the first queued event goes out as one
+# pipeline of at most XADD_BATCH_MAX entries.
+XADD_FLUSH_INTERVAL = 0.005  # seconds
+XADD_BATCH_MAX = 256
+
+# Event dedup lives in Redis (SET NX with a TTL), so it holds across worker
+# processes and replicas and expires on its own.
+DEDUP_TTL = 86400  # seconds
+# Ids this process has itself claimed in Redis, newest last.  An exact
+# (not probabilistic) local record, so a hit is a certain duplicate and can
+# skip the round trip; a miss still goes to Redis.
+RECENT_CLAIMS_MAX = 100_000
+# Events of one /events/batch request claimed concurrently, at most this many
+# Redis round trips in flight at a time
+BATCH_INGEST_CONCURRENCY = 16
+_recent_claims: OrderedDict[str, None] = OrderedDict()
 
 _redis: Optional[aioredis.Redis] = None
-# In-memory event dedup store (would be Redis in production)
-_processed_events: set[str] = set()
-_event_log: deque = deque(maxlen=1000)
+# Recent events, kept in a fixed ring: slot _event_count % EVENT_LOG_SIZE is
+# overwritten next, so reading the newest N entries slices only N slots.
+EVENT_LOG_SIZE = 1000
+_event_log: list[Optional[dict]] = [None] * EVENT_LOG_SIZE
+_event_count = 0
 _consumer_task: Optional[asyncio.Task] = None
+_xadd_queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=10000)
+_xadd_task: Optional[asyncio.Task] = None
+# Events _xadd_batcher has dequeued but not yet published; the shutdown drain
+# publishes them if the batcher is cancelled mid-window.
+_xadd_in_hand: list[dict] = []
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _redis, _consumer_task
-    _redis = await aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    global _redis, _consumer_task, _xadd_task
+    # Raw bytes; the consumer decodes only what it keeps
+    _redis = await aioredis.from_url(REDIS_URL, decode_responses=False)
     _consumer_task = asyncio.create_task(_redis_stream_consumer())
+    _xadd_task = asyncio.create_task(_xadd_batcher())
     logger.info("notifications_service_started")
     yield
     _consumer_task.cancel()
+    _xadd_task.cancel()
+    try:
+        await _xadd_task
+    except asyncio.CancelledError:
+        pass
+    # Publish whatever was still waiting for the next flush.  A batch cut off
+    # mid-publish goes out again; the consumer dedups on event_id.
+    pending = list(_xadd_in_hand)
+    while not _xadd_queue.empty():
+        pending.append(_xadd_queue.get_nowait())
+    if pending:
+        await _publish_events(pending)
     await _redis.aclose()
 
 
+def _log_event(record: dict) -> None:
+    global _event_count
+    _event_log[_event_count % EVENT_LOG_SIZE] = record
+    _event_count += 1
+
+
+def _recent_events(limit: int) -> list[dict]:
+    """Return the newest *limit* events, oldest first."""
+    n = min(limit, _event_count, EVENT_LOG_SIZE)
+    if n <= 0:
+        return []
+    end = _event_count % EVENT_LOG_SIZE
+    start = (end - n) % EVENT_LOG_SIZE
+    if start < end:
+        return _event_log[start:end]
+    return _event_log[start:] + _event_log[:end]
+
+
+def _dedup_key(event_id: str) -> str:
+    return f"dedup:{event_id}"
+
+
+def _remember_claim(event_id: str) -> None:
+    _recent_claims[event_id] = None
+    if len(_recent_claims) > RECENT_CLAIMS_MAX:
+        _recent_claims.popitem(last=False)
+
+
+async def _claim_event(event_id: str) -> bool:
+    """Mark *event_id* processed; False if it already was.  Fails open."""
+    if event_id in _recent_claims:
+        return False
+    if _redis is None:
+        return True
+    try:
+        claimed = await _redis.set(_dedup_key(event_id), 1, nx=True, ex=DEDUP_TTL) is True
+    except Exception as exc:
+        logger.warning("dedup_store_error", extra={"error": str(exc)})
+        return True
+    if claimed:
+        _remember_claim(event_id)
+    return claimed
+
+
+async def _publish_events(batch: list[dict]) -> None:
+    try:
+        async with _redis.pipeline(transaction=False) as pipe:
+            for fields in batch:
+                pipe.xadd(STREAM_KEY, fields)
+            await pipe.execute()
+    except Exception as exc:
+        logger.warning(
+            "redis_stream_publish_error",
+            extra={"error": str(exc), "batch_size": len(batch)},
+        )
+
+
+async def _xadd_batcher():
+    """Background task: publish queued events to the Redis Stream in batches."""
+    global _xadd_in_hand
+    while True:
+        batch = _xadd_in_hand = [await _xadd_queue.get()]
+        # Let the window fill before flushing
+        await asyncio.sleep(XADD_FLUSH_INTERVAL)
+        while len(batch) < XADD_BATCH_MAX and not _xadd_queue.empty():
+            batch.append(_xadd_queue.get_nowait())
+        await _publish_events(batch)
+        _xadd_in_hand = []
+
+
 async def _redis_stream_consumer():
     """Background task: consume events from Redis Stream."""
-    stream_key = "notifications:events"
+    stream_key = STREAM_KEY
     group_name = "notifications-group"
     consumer_name = f"consumer-{os.getpid()}"
 
@@ -70,27 +181,46 @@ async def _redis_stream_consumer():
                 await asyncio.sleep(1)
                 continue
             messages = await _redis.xreadgroup(
-                group_name, consumer_name, {stream_key: ">"}, count=10, block=1000
+                group_name, consumer_name, {stream_key: ">"}, count=512, block=5000
             )
-            for _stream, entries in (messages or []):
-                for msg_id, data in entries:
-                    event_id = data.get("event_id", str(msg_id))
-                    if event_id in _processed_events:
-                        # Dedup: already processed
-                        DUPLICATE_WRITE_RATE.labels(
-                            service=SERVICE_NAME, operation="consume_event"
-                        ).inc()
-                        await _redis.xack(stream_key, group_name, msg_id)
-                        continue
-
-                    _processed_events.add(event_id)
-                    _event_log.append({
-                        "event_id": event_id,
-                        "data": data,
-                        "processed_at": time.time(),
-                    })
-                    logger.info("notification_sent", extra={"event_id": event_id, "data": data})
-                    await _redis.xack(stream_key, group_name, msg_id)
+            batch = [
+                (msg_id, (data.get(b"event_id") or msg_id).decode(), data)
+                for _stream, entries in (messages or [])
+                for msg_id, data in entries
+            ]
+            if not batch:
+                continue
+
+            # Claim the events not already known here in one pipelined round trip
+            unknown = [event_id for _, event_id, _ in batch if event_id not in _recent_claims]
+            claimed = set()
+            if unknown:
+                async with _redis.pipeline(transaction=False) as pipe:
+                    for event_id in unknown:
+                        pipe.set(_dedup_key(event_id), 1, nx=True, ex=DEDUP_TTL)
+                    results = await pipe.execute()
+                claimed = {event_id for event_id, ok in zip(unknown, results) if ok}
+
+            for _msg_id, event_id, data in batch:
+                if event_id not in claimed:
+                    # Dedup: already processed
+                    DUPLICATE_WRITE_RATE.labels(
+                        service=SERVICE_NAME, operation="consume_event"
+                    ).inc()
+                    continue
+
+                claimed.discard(event_id)  # a repeat within the batch is a duplicate
+                _remember_claim(event_id)
+                data = {k.decode(): v.decode() for k, v in data.items()}
+                _log_event({
+                    "event_id": event_id,
+                    "data": data,
+                    "processed_at": time.time(),
+                })
+                logger.info("notification_sent", extra={"event_id": event_id, "data": data})
+
+            # Ack the whole batch in one XACK once it has been handled
+            await _redis.xack(stream_key, group_name, *(msg_id for msg_id, _, _ in batch))
         except asyncio.CancelledError:
             break
         except Exception as exc:
@@ -100,7 +230,7 @@ async def _redis_stream_consumer():
 
 app = FastAPI(title="Notifications Service", version="1.0.0", lifespan=lifespan)
 app.add_middleware(ObservabilityMiddleware, service_name=SERVICE_NAME)
-app.mount("/metrics", make_asgi_app())
+app.mount("/metrics", cached_metrics_app())
 
 setup_tracing(SERVICE_NAME)
 
@@ -117,50 +247,71 @@ async def health():
 
 
 @app.post("/events", status_code=202)
-async def receive_event(event: EventPayload):
-    """HTTP ingestion endpoint (used by outbox worker)."""
+async def receive_event(event: EventPayload, background: BackgroundTasks):
+    """HTTP ingestion endpoint."""
+    result = await _ingest_event(event, background)
+    if result["status"] == "already_processed":
+        return JSONResponse(result, headers={"X-Idempotency-Replayed": "true"})
+    return result
+
+
+@app.post("/events/batch", status_code=202)
+async def receive_events(events: list[EventPayload], background: BackgroundTasks):
+    """Batch ingestion endpoint (used by the orders outbox worker).
+
+    Returns one result per event, in request order.
+    """
+    sem = asyncio.Semaphore(BATCH_INGEST_CONCURRENCY)
+
+    async def _ingest(event: EventPayload) -> dict:
+        async with sem:
+            return await _ingest_event(event, background)
+
+    # gather keeps request order; a repeated id within the batch still has
+    # exactly one winner, since the claim is a Redis SET NX
+    return {"results": await asyncio.gather(*(_ingest(event) for event in events))}
+
+
+async def _ingest_event(event: EventPayload, background: BackgroundTasks) -> dict:
     event_id = f"{event.event_type}:{event.aggregate_id}"
 
-    # Dedup check
-    if event_id in _processed_events:
+    # Dedup check (claims the event id when it is new)
+    if not await _claim_event(event_id):
         DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="receive_event").inc()
-        return JSONResponse(
-            {"status": "already_processed", "event_id": event_id},
-            headers={"X-Idempotency-Replayed": "true"},
-        )
+        return {"status": "already_processed", "event_id": event_id}
 
-    _processed_events.add(event_id)
-    _event_log.append({
+    # Queue for the Redis Stream (async consumers); published by _xadd_batcher
+    if _redis:
+        fields = {
+            "event_id": event_id,
+            "event_type": event.event_type,
+            "aggregate_id": event.aggregate_id,
+            "payload": orjson.dumps(event.payload),
+        }
+        try:
+            _xadd_queue.put_nowait(fields)
+        except asyncio.QueueFull:
+            await _publish_events([fields])  # backlogged: publish directly
+
+    # Bookkeeping runs after the response has been sent
+    background.add_task(_record_event, event_id, event, time.time())
+    return {"status": "accepted", "event_id": event_id}
+
+
+def _record_event(event_id: str, event: EventPayload, received_at: float) -> None:
+    _log_event({
         "event_id": event_id,
         "event_type": event.event_type,
         "aggregate_id": event.aggregate_id,
         "payload": event.payload,
-        "received_at": time.time(),
+        "received_at": received_at,
     })
-
-    # Publish to Redis Stream for async consumers
-    if _redis:
-        try:
-            await _redis.xadd(
-                "notifications:events",
-                {
-                    "event_id": event_id,
-                    "event_type": event.event_type,
-                    "aggregate_id": event.aggregate_id,
-                    "payload": json.dumps(event.payload),
-                },
-            )
-        except Exception as exc:
-            logger.warning("redis_stream_publish_error", extra={"error": str(exc)})
-
     logger.info("event_received", extra={
         "event_type": event.event_type,
         "aggregate_id": event.aggregate_id,
     })
-    return {"status": "accepted", "event_id": event_id}
 
 
 @app.get("/events")
 async def list_events(limit: int = 50):
-    events = list(_event_log)[-limit:]
-    return {"events": events, "total": len(_event_log)}
+    return {"events": _recent_events(limit), "total": min(_event_count, EVENT_LOG_SIZE)}
@@ -17,29 +17,29 @@ Resilience applied:
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import os
 import time
 import uuid
+from collections import Counter
 from contextlib import asynccontextmanager
-from typing import Optional
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Optional
 
 import asyncpg
 import httpx
+import orjson
 import redis.asyncio as aioredis
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
-from prometheus_client import make_asgi_app
 from pydantic import BaseModel, Field
 
-import sys
-sys.path.insert(0, "/app")
-
 from libs.observability import (
     setup_logging,
     setup_tracing,
     ObservabilityMiddleware,
+    cached_metrics_app,
 )
 from libs.observability.metrics import (
     DOWNSTREAM_REQUESTS_TOTAL,
@@ -51,7 +51,7 @@ from libs.observability.metrics import (
 )
 from libs.resilience import (
     RetryConfig,
-    retry_with_backoff,
+    retry_http_with_backoff,
     CircuitBreaker,
     Bulkhead,
     IdempotencyMiddleware,
@@ -69,17 +69,76 @@ PAYMENTS_URL = os.getenv("PAYMENTS_URL", "http://payments:8002")
 INVENTORY_URL = os.getenv("INVENTORY_URL", "http://inventory:8003")
 NOTIFICATIONS_URL = os.getenv("NOTIFICATIONS_URL", "http://notifications:8004")
 
+# Each order holds a connection across two transactions, so the pool bounds
+# order concurrency.  Keep DB_POOL_MAX * replica_count below the server's
+# max_connections (100 by default), leaving headroom for admin sessions.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "40"))
+DB_MAX_INACTIVE_CONN_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_CONN_LIFETIME", "300"))
+DB_MAX_QUERIES = int(os.getenv("DB_MAX_QUERIES", "50000"))
+
+# ── Redis ─────────────────────────────────────────────────────────────────────
+# One pool for the whole process, shared by the breakers and the idempotency
+# cache; built at import because the breakers are.
+_redis_pool = aioredis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=64,
+    decode_responses=True,
+    # Breaker and idempotency calls sit on the request path: fail fast
+    socket_timeout=0.5,
+    socket_connect_timeout=0.5,
+)
+_redis = aioredis.Redis(connection_pool=_redis_pool)
+
 # ── Resilience ────────────────────────────────────────────────────────────────
-_payments_breaker = CircuitBreaker("payments", failure_threshold=5, open_duration=30)
-_inventory_breaker = CircuitBreaker("inventory", failure_threshold=5, open_duration=30)
+# Breaker state lives in Redis, so every orders replica trips together.  The
+# CLOSED/OPEN state is re-read at most every 100ms; the bulkheads stay
+# per-process, as they bound this replica's own concurrency.
+_payments_breaker = CircuitBreaker("payments", failure_threshold=5, open_duration=30,
+                                   redis_client=_redis, state_cache_ttl=0.1)
+_inventory_breaker = CircuitBreaker("inventory", failure_threshold=5, open_duration=30,
+                                    redis_client=_redis, state_cache_ttl=0.1)
 _payments_bulkhead = Bulkhead("payments", max_concurrent=20, max_wait=1.0)
 _inventory_bulkhead = Bulkhead("inventory", max_concurrent=20, max_wait=1.0)
-_retry_cfg = RetryConfig(max_attempts=3, base_delay=0.1, max_delay=5.0)
+# Shared by both downstreams; RetryConfig is immutable once built
+_retry_cfg = RetryConfig(max_attempts=3, base_delay=0.2, max_delay=5.0)
+
+# ── Metrics ───────────────────────────────────────────────────────────────────
+# Bound metric children, so the hot path skips labels() resolution
+_payments_requests = DOWNSTREAM_REQUESTS_TOTAL.labels(
+    from_service=SERVICE_NAME, to_service="payments", operation="charge"
+)
+_payments_5xx = DOWNSTREAM_ERRORS_TOTAL.labels(
+    from_service=SERVICE_NAME, to_service="payments",
+    operation="charge", error_type="http_5xx",
+)
+_inventory_requests = DOWNSTREAM_REQUESTS_TOTAL.labels(
+    from_service=SERVICE_NAME, to_service="inventory", operation="reserve"
+)
+_inventory_5xx = DOWNSTREAM_ERRORS_TOTAL.labels(
+    from_service=SERVICE_NAME, to_service="inventory",
+    operation="reserve", error_type="http_5xx",
+)
+_duplicate_orders = DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="create_order")
+_outbox_pending = OUTBOX_PENDING_GAUGE.labels(service=SERVICE_NAME)
+_outbox_published: dict[str, Any] = {}  # event_type -> counter child
+
+
+def _outbox_published_counter(event_type: str) -> Any:
+    counter = _outbox_published.get(event_type)
+    if counter is None:
+        counter = _outbox_published[event_type] = OUTBOX_PUBLISHED_TOTAL.labels(
+            service=SERVICE_NAME, event_type=event_type
+        )
+    return counter
+
 
 # ── Global resources (set during lifespan) ────────────────────────────────────
 _db_pool: Optional[asyncpg.Pool] = None
-_redis: Optional[aioredis.Redis] = None
 _outbox_task: Optional[asyncio.Task] = None
+_partition_task: Optional[asyncio.Task] = None
+# Shared, keep-alive pooled client for payments/inventory/notifications calls
+_http_client: Optional[httpx.AsyncClient] = None
 
 
 # ── DB helpers ────────────────────────────────────────────────────────────────
@@ -99,108 +158,449 @@ CREATE UNIQUE INDEX IF NOT EXISTS orders_idempotency_key_idx
     ON orders (idempotency_key)
     WHERE idempotency_key IS NOT NULL;
 
+-- Partitioned by day so published history is dropped a partition at a time
+-- instead of being deleted and vacuumed row by row; see outbox partitions.
+-- The partial index is created on every partition and stays small.
 CREATE TABLE IF NOT EXISTS outbox_events (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
     aggregate_type TEXT NOT NULL,
     aggregate_id UUID NOT NULL,
     event_type TEXT NOT NULL,
     payload JSONB NOT NULL,
     published BOOLEAN NOT NULL DEFAULT FALSE,
-    created_at TIMESTAMPTZ DEFAULT NOW(),
-    published_at TIMESTAMPTZ
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    published_at TIMESTAMPTZ,
+    claimed_until TIMESTAMPTZ,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Outbox worker lease; added after the table first shipped
+ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ;
+
+-- Catches rows only if partition maintenance falls behind
+CREATE TABLE IF NOT EXISTS outbox_events_default
+    PARTITION OF outbox_events DEFAULT;
 
 CREATE INDEX IF NOT EXISTS outbox_unpublished_idx
     ON outbox_events (created_at)
     WHERE NOT published;
+
+-- Wakes the outbox worker on commit; once per statement, not per row
+CREATE OR REPLACE FUNCTION outbox_notify() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('outbox_new', '');
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER outbox_notify_trg
+    AFTER INSERT ON outbox_events
+    FOR EACH STATEMENT EXECUTE FUNCTION outbox_notify();
 """
 
 
-async def init_db() -> asyncpg.Pool:
-    pool = await asyncpg.create_pool(DB_DSN, min_size=2, max_size=10)
-    async with pool.acquire() as conn:
+# Hot-path statements of create_order, kept as constants so the pool's init
+# hook and the handler share the exact text asyncpg keys its statement cache by.
+
+# Order + order_created outbox event in one round trip; a single statement is
+# atomic, so no explicit transaction is needed.  Returns the new row, or the
+# existing one when the idempotency key was already used (the trailing SELECT
+# runs on the statement's snapshot, so it never sees the row inserted here).
+CREATE_ORDER_SQL = """
+WITH ins AS (
+    INSERT INTO orders (id, customer_id, items, total_amount, status, idempotency_key)
+    VALUES ($1, $2, $3, $4, 'pending', $5)
+    ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+    RETURNING *
+), outbox AS (
+    INSERT INTO outbox_events (aggregate_type, aggregate_id, event_type, payload)
+    SELECT 'order', id, 'order_created', $6::jsonb FROM ins
+)
+SELECT * FROM ins
+UNION ALL
+SELECT * FROM orders WHERE idempotency_key = $5
+LIMIT 1
+"""
+SELECT_ORDER_BY_KEY_SQL = "SELECT * FROM orders WHERE idempotency_key=$1"
+INSERT_OUTBOX_SQL = """
+INSERT INTO outbox_events (aggregate_type, aggregate_id, event_type, payload)
+VALUES ('order', $1, $2, $3)
+"""
+UPDATE_ORDER_STATUS_SQL = "UPDATE orders SET status=$1, updated_at=NOW() WHERE id=$2"
+
+
+def _encode_jsonb(value: Any) -> bytes:
+    return b"\x01" + orjson.dumps(value)  # binary jsonb: version byte + text
+
+
+def _decode_jsonb(data: bytes) -> Any:
+    return orjson.loads(data[1:])
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # JSONB columns take and return Python objects, (de)serialised by orjson
+    await conn.set_type_codec(
+        "jsonb", encoder=_encode_jsonb, decoder=_decode_jsonb,
+        schema="pg_catalog", format="binary",
+    )
+    await _prepare_statements(conn)
+
+
+async def _prepare_statements(conn: asyncpg.Connection) -> None:
+    """Prime a new connection's statement cache with the create_order statements.
+
+    asyncpg prepares each distinct query once per connection and reuses it
+    from its LRU cache; running them here, in a transaction that is rolled
+    back, moves that parse/plan step off the first orders served by each
+    connection.
+    """
+    warmup_id = uuid.uuid4()
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await conn.fetchrow(CREATE_ORDER_SQL, warmup_id, "", [], 0, None, {})
+        await conn.execute(INSERT_OUTBOX_SQL, warmup_id, "warmup", {})
+        await conn.execute(UPDATE_ORDER_STATUS_SQL, "pending", warmup_id)
+    finally:
+        await tr.rollback()
+
+
+# An outbox_events table created before it was partitioned is renamed out of
+# the way (with its constraint and index, whose names the new table reuses),
+# then its rows are copied into the partitioned table and it is dropped.
+RENAME_LEGACY_OUTBOX_SQL = """
+ALTER TABLE outbox_events RENAME TO outbox_events_legacy;
+ALTER TABLE outbox_events_legacy RENAME CONSTRAINT outbox_events_pkey TO outbox_events_legacy_pkey;
+ALTER INDEX IF EXISTS outbox_unpublished_idx RENAME TO outbox_events_legacy_unpublished_idx;
+"""
+COPY_LEGACY_OUTBOX_SQL = """
+INSERT INTO outbox_events
+    (id, aggregate_type, aggregate_id, event_type, payload, published, created_at, published_at)
+SELECT id, aggregate_type, aggregate_id, event_type, payload, published,
+       COALESCE(created_at, NOW()), published_at
+FROM outbox_events_legacy;
+DROP TABLE outbox_events_legacy;
+"""
+
+
+async def _create_schema(conn: asyncpg.Connection) -> None:
+    """Create the tables, migrating an unpartitioned outbox_events in place."""
+    async with conn.transaction():
+        # Replicas starting together would otherwise race on the DDL
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('orders_schema'))")
+        # relkind 'r' is a plain table; the partitioned one is 'p'
+        legacy = await conn.fetchval(
+            "SELECT relkind = 'r' FROM pg_class WHERE oid = to_regclass('outbox_events')"
+        ) is True
+        if legacy:
+            await conn.execute(RENAME_LEGACY_OUTBOX_SQL)
         await conn.execute(CREATE_TABLES_SQL)
-    return pool
+        if legacy:
+            await conn.execute(COPY_LEGACY_OUTBOX_SQL)
+            logger.info("outbox_table_partitioned")
 
 
-# ── Outbox background worker ───────────────────────────────────────────────────
-async def outbox_worker(db_pool: asyncpg.Pool, notifications_url: str) -> None:
-    """Poll the outbox table and publish unpublished events."""
-    logger.info("outbox_worker_started")
-    while True:
+async def init_db() -> asyncpg.Pool:
+    # Schema first: the pool's init prepares statements against these tables
+    conn = await asyncpg.connect(DB_DSN)
+    try:
+        await _create_schema(conn)
+        # Not fatal: rows fall into the default partition until it succeeds
         try:
-            async with db_pool.acquire() as conn:
-                rows = await conn.fetch(
-                    """
-                    SELECT id, event_type, payload, aggregate_id
-                    FROM outbox_events
-                    WHERE NOT published
-                    ORDER BY created_at
-                    LIMIT 50
-                    FOR UPDATE SKIP LOCKED
-                    """
-                )
-            if not rows:
-                await asyncio.sleep(1)
+            await maintain_outbox_partitions(conn)
+        except Exception as exc:
+            logger.error("outbox_partition_maintenance_error", extra={"error": str(exc)})
+    finally:
+        await conn.close()
+    return await asyncpg.create_pool(
+        DB_DSN,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_CONN_LIFETIME,
+        max_queries=DB_MAX_QUERIES,
+        init=_init_connection,
+    )
+
+
+# ── Outbox partitions ─────────────────────────────────────────────────────────
+OUTBOX_PARTITIONS_AHEAD = 2  # days of partitions created in advance
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_MAINTENANCE_INTERVAL = 3600.0  # seconds
+_OUTBOX_PARTITION_PREFIX = "outbox_events_p"
+
+
+def _outbox_partition_name(day: date) -> str:
+    return f"{_OUTBOX_PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def _utc_midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+async def _create_outbox_partition(conn: asyncpg.Connection, day: date) -> None:
+    """Create *day*'s partition, first moving that day's rows out of DEFAULT.
+
+    Postgres refuses to attach a range the default partition already holds
+    rows for, so those rows are parked in a temp table and re-inserted once
+    the partition exists.  Runs inside the caller's transaction.
+    """
+    name = _outbox_partition_name(day)
+    if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+        return
+    lo, hi = _utc_midnight(day), _utc_midnight(day + timedelta(days=1))
+    stranded = await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM outbox_events_default "
+        "WHERE created_at >= $1 AND created_at < $2)",
+        lo, hi,
+    )
+    if stranded:
+        await conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS outbox_moved "
+            "(LIKE outbox_events) ON COMMIT DROP"
+        )
+        await conn.execute(
+            "WITH moved AS (DELETE FROM outbox_events_default "
+            "WHERE created_at >= $1 AND created_at < $2 RETURNING *) "
+            "INSERT INTO outbox_moved SELECT * FROM moved",
+            lo, hi,
+        )
+    await conn.execute(
+        f"CREATE TABLE {name} PARTITION OF outbox_events FOR VALUES "
+        f"FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+    )
+    if stranded:
+        await conn.execute("INSERT INTO outbox_events SELECT * FROM outbox_moved")
+        await conn.execute("DELETE FROM outbox_moved")
+
+
+async def maintain_outbox_partitions(conn: asyncpg.Connection) -> None:
+    """Create the upcoming daily outbox partitions and drop expired ones.
+
+    A partition past OUTBOX_RETENTION_DAYS is only dropped once every event
+    in it has been published; published rows that old are likewise pruned
+    from the default partition.  Serialised across replicas by an advisory
+    lock.
+    """
+    today = datetime.now(timezone.utc).date()
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('outbox_partitions'))")
+        for offset in range(OUTBOX_PARTITIONS_AHEAD + 1):
+            await _create_outbox_partition(conn, today + timedelta(days=offset))
+
+        cutoff_day = today - timedelta(days=OUTBOX_RETENTION_DAYS)
+        await conn.execute(
+            "DELETE FROM outbox_events_default WHERE published AND created_at < $1",
+            _utc_midnight(cutoff_day),
+        )
+        cutoff = _outbox_partition_name(cutoff_day)
+        partitions = await conn.fetch(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'outbox_events'::regclass"
+        )
+        for (name,) in partitions:
+            # Fixed-width names, so string order is date order
+            if not name.startswith(_OUTBOX_PARTITION_PREFIX) or name >= cutoff:
+                continue
+            if await conn.fetchval(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE NOT published)"):
+                logger.warning("outbox_partition_has_unpublished", extra={"partition": name})
                 continue
+            await conn.execute(f"DROP TABLE {name}")
+            logger.info("outbox_partition_dropped", extra={"partition": name})
 
-            for row in rows:
-                try:
-                    async with httpx.AsyncClient(timeout=5.0) as client:
-                        resp = await client.post(
-                            f"{notifications_url}/events",
-                            json={
-                                "event_type": row["event_type"],
-                                "aggregate_id": str(row["aggregate_id"]),
-                                "payload": dict(row["payload"]),
-                            },
-                        )
-                        if resp.status_code < 300:
-                            async with db_pool.acquire() as conn:
-                                await conn.execute(
-                                    "UPDATE outbox_events SET published=TRUE, "
-                                    "published_at=NOW() WHERE id=$1",
-                                    row["id"],
-                                )
-                            OUTBOX_PUBLISHED_TOTAL.labels(
-                                service=SERVICE_NAME, event_type=row["event_type"]
-                            ).inc()
-                except Exception as exc:
-                    logger.warning(
-                        "outbox_publish_error",
-                        extra={"event_id": str(row["id"]), "error": str(exc)},
-                    )
 
-            # Update pending gauge
+async def outbox_partition_maintainer(db_pool: asyncpg.Pool) -> None:
+    """Background task: keep outbox partitions ahead of the clock."""
+    while True:
+        await asyncio.sleep(OUTBOX_MAINTENANCE_INTERVAL)
+        try:
             async with db_pool.acquire() as conn:
-                count = await conn.fetchval(
-                    "SELECT COUNT(*) FROM outbox_events WHERE NOT published"
-                )
-            OUTBOX_PENDING_GAUGE.labels(service=SERVICE_NAME).set(count or 0)
-
+                await maintain_outbox_partitions(conn)
         except Exception as exc:
-            logger.error("outbox_worker_error", extra={"error": str(exc)})
-            await asyncio.sleep(5)
+            logger.error("outbox_partition_maintenance_error", extra={"error": str(exc)})
+
+
+# ── Outbox background worker ───────────────────────────────────────────────────
+OUTBOX_BATCH_SIZE = 50
+# Idle polling adapts between these bounds: a full batch halves the interval
+# (and the next batch is fetched at once), a quarter-full or empty one doubles it.
+OUTBOX_POLL_MIN = 0.05  # seconds
+OUTBOX_POLL_MAX = 2.0
+# The worker also LISTENs on this channel (notified by the outbox_events insert
+# trigger), so new events cut the idle wait short; polling stays as the safety
+# net for missed notifications.
+OUTBOX_NOTIFY_CHANNEL = "outbox_new"
+# Rows are claimed with a lease and the claim is committed before the POST, so
+# no connection, transaction or row lock is held across the HTTP call.  A
+# worker that dies mid-batch leaves its rows to be re-claimed once the lease
+# runs out; notifications dedups the redelivery.
+OUTBOX_CLAIM_LEASE = 30.0  # seconds; well above the 5s publish timeout
+
+CLAIM_OUTBOX_SQL = """
+UPDATE outbox_events SET claimed_until = NOW() + make_interval(secs => $2)
+WHERE (id, created_at) IN (
+    SELECT id, created_at FROM outbox_events
+    WHERE NOT published AND (claimed_until IS NULL OR claimed_until < NOW())
+    ORDER BY created_at
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, event_type, payload, aggregate_id
+"""
+# Marks the published ids ($1) and releases the rest of the claim ($2), so a
+# failed publish is retried on the next tick rather than after the lease
+SETTLE_OUTBOX_SQL = """
+UPDATE outbox_events
+SET published = id = ANY($1::uuid[]),
+    published_at = CASE WHEN id = ANY($1::uuid[]) THEN NOW() END,
+    claimed_until = NULL
+WHERE id = ANY($2::uuid[])
+"""
+
+
+async def _publish_outbox_batch(
+    http_client: httpx.AsyncClient, notifications_url: str, rows: list
+) -> tuple[list, Counter]:
+    """POST *rows* to notifications in one request.
+
+    Returns the ids notifications accepted and their count per event type.
+    """
+    published_ids = []
+    published_types = Counter()
+    try:
+        resp = await http_client.post(
+            f"{notifications_url}/events/batch",
+            json=[
+                {
+                    "event_type": row["event_type"],
+                    "aggregate_id": str(row["aggregate_id"]),
+                    "payload": row["payload"],
+                }
+                for row in rows
+            ],
+            timeout=5.0,
+        )
+        if resp.status_code < 300:
+            for row, result in zip(rows, orjson.loads(resp.content)["results"]):
+                # A duplicate was delivered earlier; it is published too
+                if result["status"] in ("accepted", "already_processed"):
+                    published_ids.append(row["id"])
+                    published_types[row["event_type"]] += 1
+        else:
+            logger.warning(
+                "outbox_publish_error",
+                extra={"batch_size": len(rows), "status_code": resp.status_code},
+            )
+    except Exception as exc:
+        logger.warning(
+            "outbox_publish_error",
+            extra={"batch_size": len(rows), "error": str(exc)},
+        )
+    return published_ids, published_types
+
+
+async def _listen_for_outbox(wake: asyncio.Event) -> Optional[asyncpg.Connection]:
+    """Open a dedicated connection that sets *wake* on every outbox insert."""
+    try:
+        conn = await asyncpg.connect(DB_DSN)
+        await conn.add_listener(OUTBOX_NOTIFY_CHANNEL, lambda *_: wake.set())
+        return conn
+    except Exception as exc:
+        logger.warning("outbox_listen_error", extra={"error": str(exc)})
+        return None
+
+
+async def _wait_for_outbox(wake: asyncio.Event, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(wake.wait(), timeout)
+        # Let the rest of a burst of inserts land before fetching
+        await asyncio.sleep(OUTBOX_POLL_MIN)
+    except asyncio.TimeoutError:
+        pass
+    wake.clear()
+
+
+async def outbox_worker(
+    db_pool: asyncpg.Pool, http_client: httpx.AsyncClient, notifications_url: str
+) -> None:
+    """Publish unpublished outbox events, woken by NOTIFY or by polling."""
+    logger.info("outbox_worker_started")
+    poll_interval = 1.0
+    wake = asyncio.Event()
+    listener: Optional[asyncpg.Connection] = None
+    try:
+        while True:
+            try:
+                if listener is None or listener.is_closed():
+                    listener = await _listen_for_outbox(wake)
+
+                # Claim (autocommit), publish with no connection held, settle
+                published_ids, published_types = [], Counter()
+                async with db_pool.acquire() as conn:
+                    rows = await conn.fetch(
+                        CLAIM_OUTBOX_SQL, OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_LEASE
+                    )
+                if rows:
+                    published_ids, published_types = await _publish_outbox_batch(
+                        http_client, notifications_url, rows
+                    )
+                    async with db_pool.acquire() as conn:
+                        await conn.execute(
+                            SETTLE_OUTBOX_SQL, published_ids, [row["id"] for row in rows]
+                        )
+                        count = await conn.fetchval(
+                            "SELECT COUNT(*) FROM outbox_events WHERE NOT published"
+                        )
+                    _outbox_pending.set(count or 0)
+                    for event_type, n in published_types.items():
+                        _outbox_published_counter(event_type).inc(n)
+
+                if len(rows) == OUTBOX_BATCH_SIZE:
+                    poll_interval = max(OUTBOX_POLL_MIN, poll_interval / 2)
+                    if len(published_ids) == len(rows):
+                        continue  # backlog: fetch the next batch straight away
+                elif len(rows) <= OUTBOX_BATCH_SIZE // 4:
+                    poll_interval = min(OUTBOX_POLL_MAX, poll_interval * 2)
+                if len(published_ids) < len(rows):
+                    # Publishing is failing: new inserts must not hurry the retry
+                    await asyncio.sleep(poll_interval)
+                else:
+                    await _wait_for_outbox(wake, poll_interval)
+
+            except Exception as exc:
+                logger.error("outbox_worker_error", extra={"error": str(exc)})
+                await asyncio.sleep(5)
+    finally:
+        if listener is not None:
+            await listener.close()
 
 
 # ── Lifespan ──────────────────────────────────────────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _db_pool, _redis, _outbox_task
+    global _db_pool, _outbox_task, _partition_task, _http_client
     _db_pool = await init_db()
-    _redis = await aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
-    _outbox_task = asyncio.create_task(outbox_worker(_db_pool, NOTIFICATIONS_URL))
+    _http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(8.0, connect=1.0),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    )
+    _outbox_task = asyncio.create_task(
+        outbox_worker(_db_pool, _http_client, NOTIFICATIONS_URL)
+    )
+    _partition_task = asyncio.create_task(outbox_partition_maintainer(_db_pool))
     logger.info("orders_service_started")
     yield
     _outbox_task.cancel()
-    await _redis.aclose()
+    _partition_task.cancel()
+    await _http_client.aclose()
+    await _redis_pool.disconnect()
     await _db_pool.close()
 
 
 # ── App ───────────────────────────────────────────────────────────────────────
 app = FastAPI(title="Orders Service", version="1.0.0", lifespan=lifespan)
 app.add_middleware(ObservabilityMiddleware, service_name=SERVICE_NAME)
-app.mount("/metrics", make_asgi_app())
+app.mount("/metrics", cached_metrics_app())
 
 setup_tracing(SERVICE_NAME)
 
@@ -232,70 +632,51 @@ def _get_forward_headers(request: Request) -> dict:
     return headers
 
 
-async def _call_payments(order_id: str, amount: float, headers: dict) -> dict:
-    budget = [3]  # max 3 retries within this request
-    retry_cfg = RetryConfig(
-        max_attempts=3, base_delay=0.2, max_delay=5.0, retry_budget=[budget[0]]
+async def _post_charge(order_id: str, amount: float, headers: dict) -> httpx.Response:
+    _payments_requests.inc()
+    resp = await _http_client.post(
+        f"{PAYMENTS_URL}/payments/charge",
+        json={"order_id": order_id, "amount": amount},
+        headers=headers,
     )
-
-    async def _do():
-        DOWNSTREAM_REQUESTS_TOTAL.labels(
-            from_service=SERVICE_NAME, to_service="payments", operation="charge"
-        ).inc()
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            resp = await client.post(
-                f"{PAYMENTS_URL}/payments/charge",
-                json={"order_id": order_id, "amount": amount},
-                headers=headers,
-            )
-            if resp.status_code >= 500:
-                DOWNSTREAM_ERRORS_TOTAL.labels(
-                    from_service=SERVICE_NAME, to_service="payments",
-                    operation="charge", error_type="http_5xx",
-                ).inc()
-                resp.raise_for_status()
-            return resp
-
-    resp = await _payments_bulkhead.call(
-        lambda: _payments_breaker.call(
-            lambda: retry_with_backoff(_do, retry_cfg,
-                                       service_name=SERVICE_NAME, operation="charge")
-        )
-    )
-    return resp.json()
-
-
-async def _call_inventory(order_id: str, items: list, headers: dict) -> dict:
-    retry_cfg = RetryConfig(max_attempts=3, base_delay=0.2, max_delay=5.0)
-
-    async def _do():
-        DOWNSTREAM_REQUESTS_TOTAL.labels(
-            from_service=SERVICE_NAME, to_service="inventory", operation="reserve"
-        ).inc()
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            resp = await client.post(
-                f"{INVENTORY_URL}/inventory/reserve",
-                json={
-                    "order_id": order_id,
-                    "items": [i.model_dump() for i in items],
-                },
-                headers=headers,
-            )
-            if resp.status_code >= 500:
-                DOWNSTREAM_ERRORS_TOTAL.labels(
-                    from_service=SERVICE_NAME, to_service="inventory",
-                    operation="reserve", error_type="http_5xx",
-                ).inc()
-                resp.raise_for_status()
-            return resp
-
-    resp = await _inventory_bulkhead.call(
-        lambda: _inventory_breaker.call(
-            lambda: retry_with_backoff(_do, retry_cfg,
-                                       service_name=SERVICE_NAME, operation="reserve")
-        )
+    if resp.status_code >= 500:
+        _payments_5xx.inc()
+        resp.raise_for_status()
+    return resp
+
+
+async def _post_reserve(order_id: str, items: list[dict], headers: dict) -> httpx.Response:
+    _inventory_requests.inc()
+    resp = await _http_client.post(
+        f"{INVENTORY_URL}/inventory/reserve",
+        json={
+            "order_id": order_id,
+            "items": items,
+        },
+        headers=headers,
     )
-    return resp.json()
+    if resp.status_code >= 500:
+        _inventory_5xx.inc()
+        resp.raise_for_status()
+    return resp
+
+
+async def _call_payments(order_id: str, amount: float, headers: dict) -> dict:
+    resp = await _payments_bulkhead.call(partial(
+        _payments_breaker.call,
+        partial(retry_http_with_backoff, partial(_post_charge, order_id, amount, headers),
+                _retry_cfg, service_name=SERVICE_NAME, operation="charge"),
+    ))
+    return orjson.loads(resp.content)
+
+
+async def _call_inventory(order_id: str, items: list[dict], headers: dict) -> dict:
+    resp = await _inventory_bulkhead.call(partial(
+        _inventory_breaker.call,
+        partial(retry_http_with_backoff, partial(_post_reserve, order_id, items, headers),
+                _retry_cfg, service_name=SERVICE_NAME, operation="reserve"),
+    ))
+    return orjson.loads(resp.content)
 
 
 # ── Routes ────────────────────────────────────────────────────────────────────
@@ -317,56 +698,41 @@ async def create_order(req: CreateOrderRequest, request: Request):
     if idempotency_key and _redis:
         cached = await _redis.get(f"idem:orders:{idempotency_key}")
         if cached:
-            DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="create_order").inc()
-            return JSONResponse(json.loads(cached), status_code=200,
-                                headers={"X-Idempotency-Replayed": "true"})
-
-    total = sum(i.quantity * i.unit_price for i in req.items)
+            _duplicate_orders.inc()
+            # Already serialised JSON; hand it back without a decode/encode cycle
+            return Response(cached, status_code=200, media_type="application/json",
+                            headers={"X-Idempotency-Replayed": "true"})
+
+    # Dumped once (one serializer pass) and shared by the total, the DB insert
+    # and the inventory call
+    items = req.model_dump(include={"items"})["items"]
+    total = sum(i["quantity"] * i["unit_price"] for i in items)
     order_id = str(uuid.uuid4())
 
-    # Persist order + outbox event atomically
+    # Persist order + outbox event atomically, deduplicating on the key
     async with _db_pool.acquire() as conn:
-        async with conn.transaction():
-            # Check for duplicate idempotency key at DB level
-            if idempotency_key:
-                existing = await conn.fetchrow(
-                    "SELECT id FROM orders WHERE idempotency_key=$1", idempotency_key
-                )
-                if existing:
-                    DUPLICATE_WRITE_RATE.labels(
-                        service=SERVICE_NAME, operation="create_order"
-                    ).inc()
-                    row = await conn.fetchrow(
-                        "SELECT * FROM orders WHERE id=$1", existing["id"]
-                    )
-                    result = _order_row_to_dict(row)
-                    return JSONResponse(result, status_code=200,
-                                        headers={"X-Idempotency-Replayed": "true"})
-
-            await conn.execute(
-                """
-                INSERT INTO orders (id, customer_id, items, total_amount, status, idempotency_key)
-                VALUES ($1, $2, $3, $4, 'pending', $5)
-                """,
-                order_id,
-                req.customer_id,
-                json.dumps([i.model_dump() for i in req.items]),
-                total,
-                idempotency_key,
-            )
-            # Outbox event
-            await conn.execute(
-                """
-                INSERT INTO outbox_events (aggregate_type, aggregate_id, event_type, payload)
-                VALUES ('order', $1, 'order_created', $2)
-                """,
-                order_id,
-                json.dumps({
-                    "order_id": order_id,
-                    "customer_id": req.customer_id,
-                    "total_amount": float(total),
-                }),
-            )
+        row = await conn.fetchrow(
+            CREATE_ORDER_SQL,
+            order_id,
+            req.customer_id,
+            items,
+            total,
+            idempotency_key,
+            {
+                "order_id": order_id,
+                "customer_id": req.customer_id,
+                "total_amount": float(total),
+            },
+        )
+        if row is None:
+            # Lost a race with a concurrent insert of the same key, which
+            # committed after this statement's snapshot was taken
+            row = await conn.fetchrow(SELECT_ORDER_BY_KEY_SQL, idempotency_key)
+
+    if str(row["id"]) != order_id:
+        _duplicate_orders.inc()
+        return JSONResponse(_order_row_to_dict(row), status_code=200,
+                            headers={"X-Idempotency-Replayed": "true"})
 
     # Call payments + inventory in parallel
     payment_result = None
@@ -376,7 +742,7 @@ async def create_order(req: CreateOrderRequest, request: Request):
     try:
         payment_result, inventory_result = await asyncio.gather(
             _call_payments(order_id, total, forward_headers),
-            _call_inventory(order_id, req.items, forward_headers),
+            _call_inventory(order_id, items, forward_headers),
             return_exceptions=True,
         )
 
@@ -395,18 +761,13 @@ async def create_order(req: CreateOrderRequest, request: Request):
 
     # Update order status
     async with _db_pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE orders SET status=$1, updated_at=NOW() WHERE id=$2",
-            final_status, order_id,
-        )
+        await conn.execute(UPDATE_ORDER_STATUS_SQL, final_status, order_id)
         # Add final outbox event
         await conn.execute(
-            """
-            INSERT INTO outbox_events (aggregate_type, aggregate_id, event_type, payload)
-            VALUES ('order', $1, 'order_status_updated', $2)
-            """,
+            INSERT_OUTBOX_SQL,
             order_id,
-            json.dumps({"order_id": order_id, "status": final_status}),
+            "order_status_updated",
+            {"order_id": order_id, "status": final_status},
         )
 
     ORDERS_CREATED_TOTAL.inc()
@@ -420,14 +781,13 @@ async def create_order(req: CreateOrderRequest, request: Request):
         "inventory": inventory_result if not isinstance(inventory_result, Exception) else None,
     }
 
-    # Cache in Redis for idempotency
+    # Serialised once: the same bytes are cached for replays and sent back
+    body = orjson.dumps(result)
     if idempotency_key and _redis:
-        await _redis.setex(
-            f"idem:orders:{idempotency_key}", 86400, json.dumps(result)
-        )
+        await _redis.setex(f"idem:orders:{idempotency_key}", 86400, body)
 
     status_code = 201 if final_status == "confirmed" else 202
-    return JSONResponse(result, status_code=status_code)
+    return Response(body, status_code=status_code, media_type="application/json")
 
 
 @app.get("/orders/{order_id}")
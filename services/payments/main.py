@@ -9,7 +9,6 @@ Simulates an external payment processor with:
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import os
 import random
@@ -18,16 +17,17 @@ import uuid
 from contextlib import asynccontextmanager
 from typing import Optional
 
+import orjson
 import redis.asyncio as aioredis
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from prometheus_client import make_asgi_app
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel, Field
 
-import sys
-sys.path.insert(0, "/app")
-
-from libs.observability import setup_logging, setup_tracing, ObservabilityMiddleware
+from libs.observability import (
+    setup_logging,
+    setup_tracing,
+    ObservabilityMiddleware,
+    cached_metrics_app,
+)
 from libs.observability.metrics import DUPLICATE_WRITE_RATE
 from libs.resilience import IdempotencyMiddleware, IdempotencyStore
 
@@ -40,22 +40,38 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/1")
 # Chaos knobs – toggled by chaos scripts via Redis flags
 _FAULT_LATENCY_MS = float(os.getenv("PAYMENT_LATENCY_MS", "100"))
 _FAULT_ERROR_RATE = float(os.getenv("PAYMENT_ERROR_RATE", "0.0"))
+LATENCY_KEY = "chaos:payments:latency_ms"
+ERROR_RATE_KEY = "chaos:payments:error_rate"
+# The fault config is cached in-process.  Writers publish on this channel so
+# every replica drops its copy at once; the TTL only bounds staleness if an
+# invalidation is missed (e.g. while the subscriber reconnects).
+FAULT_INVALIDATE_CHANNEL = "chaos:payments:invalidate"
+FAULT_CACHE_TTL = 5.0  # seconds
+
+IDEM_TTL = 86400  # seconds
 
 _redis: Optional[aioredis.Redis] = None
+# ((latency_ms, error_rate), monotonic expiry); expiry 0 forces a reload
+_fault_cache: tuple[tuple[float, float], float] = ((_FAULT_LATENCY_MS, _FAULT_ERROR_RATE), 0.0)
+_invalidator_task: Optional[asyncio.Task] = None
+# Generator for chaos draws, separate from the shared module-level one
+_rng = random.Random()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _redis
+    global _redis, _invalidator_task
     _redis = await aioredis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    _invalidator_task = asyncio.create_task(_fault_config_invalidator())
     logger.info("payments_service_started")
     yield
+    _invalidator_task.cancel()
     await _redis.aclose()
 
 
 app = FastAPI(title="Payments Service", version="1.0.0", lifespan=lifespan)
 app.add_middleware(ObservabilityMiddleware, service_name=SERVICE_NAME)
-app.mount("/metrics", make_asgi_app())
+app.mount("/metrics", cached_metrics_app())
 
 setup_tracing(SERVICE_NAME)
 
@@ -65,18 +81,73 @@ class ChargeRequest(BaseModel):
     amount: float = Field(gt=0)
 
 
-async def _get_fault_config() -> tuple[float, float]:
-    """Read current fault config from Redis (allows runtime toggling)."""
-    if _redis:
+def _parse_fault_config(lat_ms: Optional[str], err_rate: Optional[str]) -> tuple[float, float]:
+    latency = float(lat_ms) if lat_ms else _FAULT_LATENCY_MS
+    error_rate = float(err_rate) if err_rate else _FAULT_ERROR_RATE
+    return latency, error_rate
+
+
+async def _get_idem_and_fault_config(
+    idem_key: Optional[str],
+) -> tuple[Optional[str], tuple[float, float]]:
+    """Fetch the idempotency entry (if *idem_key*) and the fault config.
+
+    One round trip at most; the fault keys are only read when the cached
+    config has expired or been invalidated.
+    """
+    global _fault_cache
+    config, expires_at = _fault_cache
+    if _redis is None:
+        return None, config
+    now = time.monotonic()
+    fresh = now < expires_at
+    if fresh and not idem_key:
+        return None, config
+
+    keys = [idem_key] if idem_key else []
+    if not fresh:
+        keys += (LATENCY_KEY, ERROR_RATE_KEY)
+    try:
+        values = await _redis.mget(*keys)
+    except Exception:
+        if idem_key:
+            raise
+        return None, config
+    cached = values.pop(0) if idem_key else None
+    if not fresh:
+        config = _parse_fault_config(*values)
+        _fault_cache = (config, now + FAULT_CACHE_TTL)
+    return cached, config
+
+
+def _invalidate_fault_cache() -> None:
+    global _fault_cache
+    _fault_cache = (_fault_cache[0], 0.0)
+
+
+async def _fault_config_invalidator() -> None:
+    """Background task: drop the cached fault config when any replica changes it."""
+    while True:
         try:
-            lat_ms = await _redis.get("chaos:payments:latency_ms")
-            err_rate = await _redis.get("chaos:payments:error_rate")
-            latency = float(lat_ms) if lat_ms else _FAULT_LATENCY_MS
-            error_rate = float(err_rate) if err_rate else _FAULT_ERROR_RATE
-            return latency, error_rate
-        except Exception:
-            pass
-    return _FAULT_LATENCY_MS, _FAULT_ERROR_RATE
+            async with _redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(FAULT_INVALIDATE_CHANNEL)
+                # Changes made while we were not subscribed
+                _invalidate_fault_cache()
+                async for _message in pubsub.listen():
+                    _invalidate_fault_cache()
+        except asyncio.CancelledError:
+            break
+        except Exception as exc:
+            logger.warning("fault_config_subscriber_error", extra={"error": str(exc)})
+            await asyncio.sleep(1)
+
+
+def _replay(cached: str, idempotency_key: str) -> Response:
+    DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="charge").inc()
+    logger.info("payment_idempotency_hit", extra={"key": idempotency_key})
+    # Already serialised JSON; hand it back without a decode/encode cycle
+    return Response(cached, media_type="application/json",
+                    headers={"X-Idempotency-Replayed": "true"})
 
 
 @app.get("/health")
@@ -87,24 +158,22 @@ async def health():
 @app.post("/payments/charge", status_code=200)
 async def charge(req: ChargeRequest, request: Request):
     idempotency_key = request.headers.get("Idempotency-Key")
+    idem_key = f"idem:payments:{idempotency_key}"
 
-    # Check idempotency cache
-    if idempotency_key and _redis:
-        cached = await _redis.get(f"idem:payments:{idempotency_key}")
-        if cached:
-            DUPLICATE_WRITE_RATE.labels(service=SERVICE_NAME, operation="charge").inc()
-            logger.info("payment_idempotency_hit", extra={"key": idempotency_key})
-            return JSONResponse(json.loads(cached), headers={"X-Idempotency-Replayed": "true"})
+    # Idempotency check and fault config in one round trip
+    cached, (latency_ms, error_rate) = await _get_idem_and_fault_config(
+        idem_key if idempotency_key else None
+    )
+    if cached:
+        return _replay(cached, idempotency_key)
 
     # Simulate latency + errors (chaos injection)
-    latency_ms, error_rate = await _get_fault_config()
     if latency_ms > 0:
         # Add jitter ±20%
-        jitter = latency_ms * 0.2
-        actual_latency = (latency_ms + random.uniform(-jitter, jitter)) / 1000.0
-        await asyncio.sleep(actual_latency)
+        await asyncio.sleep(latency_ms * (0.8 + 0.4 * _rng.random()) / 1000.0)
 
-    if random.random() < error_rate:
+    # No draw at all when error injection is off
+    if error_rate and _rng.random() < error_rate:
         logger.warning("payment_fault_injected", extra={"order_id": req.order_id})
         raise HTTPException(status_code=503, detail="Payment processor temporarily unavailable")
 
@@ -118,16 +187,23 @@ async def charge(req: ChargeRequest, request: Request):
         "timestamp": time.time(),
     }
 
-    # Cache result for idempotency
+    # Serialised once: the same bytes are cached for replays and sent back
+    body = orjson.dumps(result)
+
+    # Cache result for idempotency.  NX: if a concurrent request with the same
+    # key stored its result first, that one is the charge the caller gets.
     if idempotency_key and _redis:
-        await _redis.setex(f"idem:payments:{idempotency_key}", 86400, json.dumps(result))
+        if not await _redis.set(idem_key, body, nx=True, ex=IDEM_TTL):
+            cached = await _redis.get(idem_key)
+            if cached:
+                return _replay(cached, idempotency_key)
 
     logger.info("payment_charged", extra={
         "order_id": req.order_id,
         "amount": req.amount,
         "transaction_id": transaction_id,
     })
-    return result
+    return Response(body, media_type="application/json")
 
 
 @app.get("/payments/{transaction_id}")
@@ -140,9 +216,11 @@ async def set_chaos_config(latency_ms: Optional[float] = None, error_rate: Optio
     """Runtime chaos configuration endpoint."""
     if _redis:
         if latency_ms is not None:
-            await _redis.set("chaos:payments:latency_ms", str(latency_ms))
+            await _redis.set(LATENCY_KEY, str(latency_ms))
         if error_rate is not None:
-            await _redis.set("chaos:payments:error_rate", str(error_rate))
+            await _redis.set(ERROR_RATE_KEY, str(error_rate))
+        await _redis.publish(FAULT_INVALIDATE_CHANNEL, "set")
+    _invalidate_fault_cache()
     return {"status": "updated", "latency_ms": latency_ms, "error_rate": error_rate}
 
 
@@ -150,5 +228,7 @@ async def set_chaos_config(latency_ms: Optional[float] = None, error_rate: Optio
 async def clear_chaos_config():
     """Reset chaos configuration."""
     if _redis:
-        await _redis.delete("chaos:payments:latency_ms", "chaos:payments:error_rate")
+        await _redis.delete(LATENCY_KEY, ERROR_RATE_KEY)
+        await _redis.publish(FAULT_INVALIDATE_CHANNEL, "clear")
+    _invalidate_fault_cache()
     return {"status": "cleared"}
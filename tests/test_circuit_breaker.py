@@ -0,0 +1,39 @@
+"""CircuitBreaker behaviour when its shared Redis state is unavailable."""
+from __future__ import annotations
+
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from libs.resilience.circuit_breaker import CircuitBreaker, CircuitState
+
+
+class _FlakyRedis:
+    """Stands in for a Redis client: the breaker script reports *state* until
+    ``down`` is set, then raises like an unreachable server."""
+
+    def __init__(self, state: str) -> None:
+        self.state = state
+        self.down = False
+
+    def register_script(self, source: str):
+        async def run(keys, args):
+            if self.down:
+                raise ConnectionError("redis down")
+            return [self.state, ""]
+        return run
+
+
+def test_mirrored_open_reaches_half_open_when_redis_fails():
+    async def scenario():
+        redis = _FlakyRedis("open")  # tripped by another replica
+        breaker = CircuitBreaker("mirrored", open_duration=0.05, redis_client=redis)
+
+        assert await breaker._get_state() == CircuitState.OPEN
+        assert REGISTRY.get_sample_value("breaker_state", {"downstream": "mirrored"}) == 1
+
+        redis.down = True
+        await asyncio.sleep(0.06)
+        assert await breaker._get_state() == CircuitState.HALF_OPEN
+
+    asyncio.run(scenario())